@@ -0,0 +1,254 @@
+from itertools import compress, count
+import numpy as np
+from sexualnetwork import (Woman, Man, Individual, PartnerIndex, EventQueue, INFECTION_CLASSES, SEED_TYPES,
+                           MAX_PARTNER_AGE, seed_counts)
+from cohorts import Cohort, CohortPartnerIndex
+from profiling import NullProfiler
+
+NULL_PROFILER = NullProfiler()
+# with HYBRID, the ages from which women and men without partnerships are
+# kept as counts: women stop seeking partners after 74, and men older than
+# MAX_PARTNER_AGE are never chosen
+FOLD_AGE_FEMALE = 75
+FOLD_AGE_MALE = MAX_PARTNER_AGE + 1
+
+
+class AgentModel:
+    """The object model: one Woman/Man per person, in dicts keyed by id.
+
+    The simulation clock (Individual.month/year) and the id counter
+    (Individual.ids) are class attributes, so they are saved and restored with
+    the model when it is pickled.
+    """
+
+    def __init__(self, data, archive):
+        # Create dictionary of men, women and partnerships;
+        # the dead and dissolved are handed to the archive
+        self.data = data
+        self.archive = archive
+        self.women = dict()
+        self.men = dict()
+        self.partnerships = dict()
+        # HYBRID: children and the old without partnerships as counts, women first
+        self.cohorts = (Cohort(True), Cohort(False)) if data.HYBRID else None
+        self.partner_index = PartnerIndex() if self.cohorts is None else CohortPartnerIndex(self.cohorts[1], self.recruit)
+        # ids of active partnerships keyed by the month they are due to end
+        self.endings = EventQueue()
+        Individual.month = 0
+        Individual.year = 0
+        Individual.ids = count()
+        self.initialize()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        next_id = next(Individual.ids)
+        Individual.ids = count(next_id)
+        state["clock"] = (Individual.month, Individual.year, next_id)
+        return state
+
+    def __setstate__(self, state):
+        Individual.month, Individual.year, next_id = state.pop("clock")
+        Individual.ids = count(next_id)
+        self.__dict__.update(state)
+
+    @property
+    def month(self):
+        return Individual.month
+
+    def initialize(self):
+        # Build the whole age pyramid at once; HPV is seeded with one
+        # multinomial draw per age rather than one draw per person
+        data = self.data
+        generator = data.rng.transmission.generator
+        for sex, (numbers, cls, people) in enumerate(zip(data.initial_numbers(), (Woman, Man), (self.women, self.men))):
+            seeded = seed_counts(numbers, generator)
+            for age, n in enumerate(numbers.tolist()):
+                if self.counted(sex, age) and not seeded[age].any():
+                    self.cohorts[sex].add(12 * age, n=n)
+                    continue
+                cohort = [cls(age, next(Individual.ids), data) for _ in range(n)]
+                # people of one age are interchangeable, so the first ones get the infections
+                k = 0
+                for hpv, n in zip(SEED_TYPES, seeded[age].tolist()):
+                    for p in cohort[k:k + n]:
+                        p.acquire_infection(INFECTION_CLASSES[hpv])
+                    k += n
+                people.update((p.id, p) for p in cohort)
+        self.partner_index.extend(self.men.values())
+
+    def counted(self, sex, age):
+        # whether people of age start the run in a cohort
+        return self.cohorts is not None and (age < self.data.SEXUAL_DEBUT_AGE
+                                             or age >= (FOLD_AGE_FEMALE, FOLD_AGE_MALE)[sex])
+
+    def recruit(self, age, month_age):
+        # turn a boy of the cohort into a Man, when a woman chooses him
+        man = Man(age, next(Individual.ids), self.data)
+        man.month_age = month_age
+        self.men[man.id] = man
+        self.partner_index.add(man)
+        return man
+
+    def run(self):
+        while self.month < self.data.SIM_MONTHS:
+            self.step()
+
+    def step(self, profiler=NULL_PROFILER):
+        data = self.data
+        women = self.women
+        men = self.men
+        partnerships = self.partnerships
+        partner_index = self.partner_index
+        month = Individual.month
+        profiler.start()
+        existing = len(partnerships)
+        attempted = data.transmissions_attempted
+
+        cohorts = self.cohorts
+        died = natural_history(women, True, data)
+        if cohorts is not None:
+            counted_dead = [cohorts[0].natural_history(data, Individual.year, month)]
+        for _, w in women.items():
+            if w.alive:
+                w.survive_month()
+                p = w.run_partnerships(partner_index, partnerships)
+                if p is not None:
+                    self.endings.push(p.end_month, p.partnership_id, p.partnership_id)
+        profiler.lap("female")
+
+        died += natural_history(men, False, data)
+        if cohorts is not None:
+            counted_dead.append(cohorts[1].natural_history(data, Individual.year, month))
+        for _, m in men.items():
+            if m.alive:
+                m.survive_month()
+        if data.CLEARANCE == "sampled":
+            for person_id, infection_id in data.clearances.pop_due(month):
+                # the dead and those folded into HYBRID counts are gone
+                person = women.get(person_id) or men.get(person_id)
+                if person is not None and person.alive and infection_id in person.Infections:
+                    person.clear_infection(infection_id)
+        data.next_clearance_month = month + 1
+        profiler.lap("male")
+
+        for _, p in partnerships.items():
+            if p.female.alive and p.male.alive:
+                p.check_serodiscordance()
+        # partnerships end when they are due or when a partner has died
+        ending = {key for key in self.endings.pop_due(month) if key in partnerships}
+        for person in died:
+            ending.update(person.partnershipid)
+        for key in ending:
+            partnerships[key].dissolve_relationship()
+        profiler.lap("relationships")
+
+        profiler.count(formed=len(partnerships) - existing, dissolved=len(ending),
+                       transmissions=data.transmissions_attempted - attempted)
+        self.archive.retire_partnerships(month, {key: partnerships.pop(key) for key in sorted(ending)})
+        profiler.lap("cleanup")
+
+        dead = {key: women.pop(key) for key in age_population(women)}
+        if cohorts is None:
+            for _ in range(len(dead)):
+                woman_id = next(Individual.ids)
+                women[woman_id] = Woman(0, woman_id, data)
+        else:
+            self.age_cohort(0, len(dead) + len(counted_dead[0]))
+        self.archive.retire_people(month, dead)
+
+        dead = {key: men.pop(key) for key in age_population(men, partner_index)}
+        if cohorts is None:
+            for _ in range(len(dead)):
+                man_id = next(Individual.ids)
+                men[man_id] = Man(0, man_id, data)
+                partner_index.add(men[man_id])
+        else:
+            self.age_cohort(1, len(dead) + len(counted_dead[1]))
+        self.archive.retire_people(month, dead)
+        if cohorts is not None:
+            for records in counted_dead:
+                if len(records):
+                    self.archive.add_deaths(records)
+
+        Individual.month += 1
+        if Individual.month % 12 == 0:
+            Individual.year += 1
+        profiler.lap("aging")
+        profiler.count(population=len(women) + len(men) + (sum(map(len, cohorts)) if cohorts else 0))
+        profiler.end_month(month)
+
+    def age_cohort(self, sex, born):
+        # age sex's cohort, add the month's newborns, turn those reaching
+        # sexual debut into agents and fold in the old without partnerships
+        data = self.data
+        cohort = self.cohorts[sex]
+        cls, people = ((Woman, self.women), (Man, self.men))[sex]
+        cohort.age()
+        cohort.add(0, n=born)
+        debut = [cls(data.SEXUAL_DEBUT_AGE, next(Individual.ids), data)
+                 for _ in range(cohort.take(12 * data.SEXUAL_DEBUT_AGE))]
+        people.update((p.id, p) for p in debut)
+        if sex:
+            self.partner_index.extend(debut)
+
+        persons = list(people.values())
+        ages = np.fromiter((p.age for p in persons), dtype=np.intp, count=len(persons))
+        sampled = data.CLEARANCE == "sampled"
+        for k in np.flatnonzero(ages >= (FOLD_AGE_FEMALE, FOLD_AGE_MALE)[sex]).tolist():
+            p = persons[k]
+            if not p.partnershipid:
+                del people[p.id]
+                if sex:
+                    self.partner_index.remove(p)
+                cohort.add_person(p, sampled)
+
+    def refresh_parameters(self):
+        # push parameters copied onto infections at creation back from data,
+        # after data.update() has loaded a new section; people read theirs
+        # from data directly
+        for people in (self.women, self.men):
+            for p in people.values():
+                for inf in p.Infections.values():
+                    inf.refresh_parameters(self.data)
+
+
+def natural_history(people, female, data):
+    # one uniform draw per person against the per-age hazard array, then
+    # this month's counts of the survivors in one pass; returns the dead
+    persons = list(people.values())
+    ages = np.fromiter((p.age for p in persons), dtype=np.intp, count=len(persons))
+    mortality = data.MORTALITY_FEMALE if female else data.MORTALITY_MALE
+    dies = data.rng.demography.uniforms(len(persons)) < mortality[ages]
+    died = list(compress(persons, dies))
+    for p in died:
+        p.alive = False
+    masks = np.fromiter((p.infection_mask for p in persons), dtype=np.int64, count=len(persons))
+    data.count_survivors(Individual.year, female, ages[~dies], masks[~dies])
+    if data.network is not None:
+        degrees = np.fromiter((len(p.partnershipid) for p in persons), dtype=np.intp, count=len(persons))
+        data.network.count_degrees(Individual.year, female, ages[~dies], degrees[~dies])
+    return died
+
+
+def age_population(people, partner_index=None):
+    # advance everyone alive by a month and return the keys of the dead;
+    # men are moved between partner_index age buckets on their birthdays
+    keys = list(people.keys())
+    persons = list(people.values())
+    alive = np.fromiter((p.alive for p in persons), dtype=bool, count=len(persons))
+    month_age = np.fromiter((p.month_age for p in persons), dtype=np.int64, count=len(persons)) + 1
+
+    for p, m in zip(compress(persons, alive), month_age[alive].tolist()):
+        p.month_age = m
+
+    for k in np.flatnonzero(alive & (month_age % 12 == 0)).tolist():
+        p = persons[k]
+        p.age += 1
+        if partner_index is not None:
+            partner_index.move(p, p.age - 1)
+
+    dead = [keys[k] for k in np.flatnonzero(~alive).tolist()]
+    if partner_index is not None:
+        for key in dead:
+            partner_index.remove(people[key])
+    return dead
@@ -0,0 +1,126 @@
+import numpy as np
+from sexualnetwork import Gender, PartnershipType
+
+PERSON_FIELDS = ["month", "female", "age", "month_age", "infection_mask", "cleared_mask"]
+PARTNERSHIP_FIELDS = ["month", "type", "duration", "maxdur", "sexacts"]
+
+
+class ArchiveError(Exception):
+    """A custom exception used to report an unknown RETENTION mode"""
+
+
+class RecordLog:
+    """Append-only CSV of integer records with a fixed-size in-memory buffer"""
+
+    def __init__(self, filename, fields, buffer_size):
+        self.filename = filename
+        self.buffer = np.zeros((buffer_size, len(fields)), dtype=np.int64)
+        self.used = 0
+        with open(filename, "w") as f:
+            f.write(",".join(fields) + "\n")
+            self.size = f.tell()
+
+    def append(self, records):
+        while len(records) > 0:
+            n = min(len(records), len(self.buffer) - self.used)
+            self.buffer[self.used:self.used + n] = records[:n]
+            self.used += n
+            records = records[n:]
+            if self.used == len(self.buffer):
+                self.flush()
+
+    def flush(self):
+        if self.used:
+            with open(self.filename, "a") as f:
+                np.savetxt(f, self.buffer[:self.used], fmt="%d", delimiter=",")
+                self.size = f.tell()
+            self.used = 0
+
+    def truncate(self):
+        # drop anything written after the last flush, e.g. by a run that
+        # crashed after the checkpoint this log was restored from
+        with open(self.filename, "a") as f:
+            f.truncate(self.size)
+
+
+class Archive:
+    """What happens to people who die and partnerships that dissolve.
+
+    RETENTION = keep    hold the objects for the whole run (agent model only)
+    RETENTION = drop    discard them
+    RETENTION = counts  keep deaths by sex and age and dissolutions by type
+    RETENTION = log     stream one record per event to dead_<run>.csv and
+                        partnerships_<run>.csv, buffering RETENTION_BUFFER rows
+    """
+
+    MODES = ("keep", "drop", "counts", "log")
+
+    def __init__(self, mode, run, n_ages, buffer_size=10000):
+        if mode not in self.MODES:
+            raise ArchiveError(f"Unknown RETENTION mode {mode!r}, expected one of {self.MODES}")
+        self.mode = mode
+        self.run = run
+        self.dead = dict()
+        self.partnerships = dict()
+        # deaths[female, age]; dissolutions[type] and their summed durations
+        self.deaths = np.zeros((2, n_ages), dtype=np.int64)
+        self.dissolutions = np.zeros(len(PartnershipType) + 1, dtype=np.int64)
+        self.dissolved_months = np.zeros(len(PartnershipType) + 1, dtype=np.int64)
+        self.person_log = None
+        self.partnership_log = None
+        if mode == "log":
+            self.person_log = RecordLog("dead_" + run + ".csv", PERSON_FIELDS, buffer_size)
+            self.partnership_log = RecordLog("partnerships_" + run + ".csv", PARTNERSHIP_FIELDS, buffer_size)
+
+    def retire_people(self, month, people):
+        # people: dict of dead Woman/Man objects keyed by id
+        if self.mode == "keep":
+            self.dead.update(people)
+        elif self.mode != "drop" and people:
+            self.add_deaths(np.array([
+                (month, p.gender is Gender.FEMALE, p.age, p.month_age, p.infection_mask, p.cleared_mask)
+                for p in people.values()], dtype=np.int64))
+
+    def retire_partnerships(self, month, partnerships):
+        # partnerships: dict of dissolved Partnership objects keyed by id
+        if self.mode == "keep":
+            self.partnerships.update(partnerships)
+        elif self.mode != "drop" and partnerships:
+            self.add_dissolutions(np.array([
+                (month, p.partnership_type.value, p.partnership_duration, p.maxdur, p.sexacts)
+                for p in partnerships.values()], dtype=np.int64))
+
+    def add_deaths(self, records):
+        # records: int array with PERSON_FIELDS columns
+        if self.mode == "counts":
+            np.add.at(self.deaths, (records[:, 1], records[:, 2]), 1)
+        elif self.mode == "log":
+            self.person_log.append(records)
+
+    def add_dissolutions(self, records):
+        # records: int array with PARTNERSHIP_FIELDS columns
+        if self.mode == "counts":
+            np.add.at(self.dissolutions, records[:, 1], 1)
+            np.add.at(self.dissolved_months, records[:, 1], records[:, 2])
+        elif self.mode == "log":
+            self.partnership_log.append(records)
+
+    def flush(self):
+        if self.mode == "log":
+            self.person_log.flush()
+            self.partnership_log.flush()
+
+    def resume(self):
+        if self.mode == "log":
+            self.person_log.truncate()
+            self.partnership_log.truncate()
+
+    def close(self):
+        self.flush()
+        if self.mode == "counts":
+            np.savetxt("deaths_" + self.run + ".csv", self.deaths[::-1].T, fmt="%d", delimiter=",",
+                       header="female,male", comments="")
+            types = [t.value for t in PartnershipType]
+            summary = np.column_stack([types, self.dissolutions[types], self.dissolved_months[types]])
+            np.savetxt("dissolutions_" + self.run + ".csv", summary, fmt="%d", delimiter=",",
+                       header="type,count,months", comments="")
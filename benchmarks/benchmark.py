@@ -0,0 +1,285 @@
+"""Benchmarks for the sexual network model.
+
+Times initialization and the monthly loop of each engine, and the core
+methods of the agent model, over a grid of COHORT_SIZE, SIM_YEARS and
+CONCURRENCY_MALE/CONCURRENCY_FEMALE values. Input tables are synthetic, so the
+numbers only depend on the code. Each case runs in a fresh process so its peak
+memory is its own. Results are stored as JSON so two commits can be compared:
+
+    python benchmarks/benchmark.py --output before.json
+    python benchmarks/benchmark.py --output after.json
+    python benchmarks/benchmark.py --compare before.json after.json
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import itertools
+import configparser
+import subprocess
+import tempfile
+import multiprocessing
+import numpy as np
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from sexualnetwork import Data, Individual
+from archive import Archive
+from main import make_model
+from agent import natural_history
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+N_AGES = 91
+MAX_PARTNER_AGES = 75
+
+PARAMETERS = {
+    "CYCLE_LENGTH": "12",
+    "PROB_MARITAL": "0.3",
+    "PROB_CASUAL": "0.4",
+    "PROB_SHORT_TERM": "0.2",
+    "PROB_INSTANTANEOUS": "0.1",
+    "DUR_MARITAL": "40",
+    "DUR_CASUAL": "1",
+    "DUR_SHORT_TERM": "3",
+    "SEX_PER_MONTH_MARITAL": "8",
+    "SEX_PER_MONTH_CASUAL": "10",
+    "SEX_PER_MONTH_SHORT_TERM": "11",
+    "SEXUAL_DEBUT_AGE": "15",
+    "TRANSMISSION_PER_SEX_ACT": "0.4",
+    "NATURAL_IMMUNITY_HPV16": "0.45",
+    "NATURAL_IMMUNITY_HPV18": "0.45",
+    "NATURAL_IMMUNITY_HPVoHR": "0.45",
+    "NATURAL_IMMUNITY_HPVLR": "0.45",
+    "RETENTION": "drop",
+}
+
+
+def write_fixtures(directory):
+    # synthetic input tables with the same shapes as the shipped CSVs
+    ages = np.arange(N_AGES)
+    mortality = np.clip(0.0002 * np.exp(0.08 * ages), 0, 1)
+    mortality[-1] = 1.0
+    population = np.exp(-ages / 40.0)
+    population /= population.sum() * 2
+    formation = np.where((ages >= 15) & (ages <= 74), 0.3, 0.0)
+    partner_age = np.clip(ages[:MAX_PARTNER_AGES] + 3, 0, 72) * (ages[:MAX_PARTNER_AGES] >= 15)
+    clearance = np.tile([0.04, 0.07, 0.06, 0.08], (900, 1))
+
+    tables = {
+        "BACKGROUND_MORTALITY_FEMALE_FILE": ("mASR", mortality[:, None]),
+        "BACKGROUND_MORTALITY_MALE_FILE": ("mASR", np.minimum(mortality * 1.2, 1.0)[:, None]),
+        "AGE_OF_PARTNER_FILE": ("mean,SD", np.column_stack([partner_age, np.full(MAX_PARTNER_AGES, 3)])),
+        "PARTNERSHIP_FORMATION_FILE": ("Female,Male", np.column_stack([formation, formation])),
+        "INITIAL_POPULATION_FILE": ("FEMALE,MALE", np.column_stack([population, population])),
+        "HPV_CLEARANCE_FILE": ("HPV16,HPV18,HPVoHR,HPVLR", clearance),
+    }
+    files = dict()
+    for key, (header, values) in tables.items():
+        filename = os.path.join(directory, key.lower().replace("_file", ".csv"))
+        np.savetxt(filename, values, delimiter=",", header=header, comments="", fmt="%.6g")
+        files[key] = filename
+    return files
+
+
+def make_section(files, case):
+    section = dict(PARAMETERS)
+    section.update(files)
+    section.update({
+        "COHORT_SIZE": str(case["cohort"]),
+        "SIM_YEARS": str(case["years"]),
+        "CONCURRENCY_MALE": str(case["concurrency_male"]),
+        "CONCURRENCY_FEMALE": str(case["concurrency_female"]),
+        "ENGINE": case["engine"],
+        "SEED": str(case["seed"]),
+    })
+    if case["shards"]:
+        section["SHARDS"] = str(case["shards"])
+    return section
+
+
+def time_calls(function, items):
+    # seconds per call of function over items
+    items = list(items)
+    start = time.perf_counter()
+    for item in items:
+        function(item)
+    elapsed = time.perf_counter() - start
+    return {"calls": len(items), "seconds": elapsed, "per_call": elapsed / len(items) if items else None}
+
+
+def bench_methods(model):
+    # time the core agent-model methods on the population left by the run,
+    # counting anything they record into its last simulated year
+    Individual.year = model.data.SIM_YEARS - 1
+    partner_index = model.partner_index
+    partnerships = model.partnerships
+    women = [w for w in model.women.values() if w.alive and model.data.SEXUAL_DEBUT_AGE <= w.age <= 74]
+    people = list(model.women.values()) + list(model.men.values())
+    return {
+        "Partnership.check_serodiscordance": time_calls(lambda p: p.check_serodiscordance(), list(partnerships.values())),
+        "Woman.create_partnership": time_calls(lambda w: w.create_partnership(partner_index, partnerships), women),
+        "Individual.survive_month": time_calls(lambda p: p.survive_month(), people),
+        # last, as it kills people; one call per sex
+        "agent.natural_history": time_calls(lambda args: natural_history(*args, model.data),
+                                            [(model.women, True), (model.men, False)]),
+    }
+
+
+def bench_case(case, files):
+    parser = configparser.ConfigParser()
+    parser.read_dict({"benchmark": make_section(files, case)})
+    data = Data(parser["benchmark"])
+
+    start = time.perf_counter()
+    model = make_model(data, Archive("drop", "benchmark", data.N_AGES))
+    initialization = time.perf_counter() - start
+
+    population = len(model.women) + len(model.men) if data.ENGINE == "agent" else model.population.size
+    start = time.perf_counter()
+    model.run()
+    loop = time.perf_counter() - start
+
+    result = dict(case)
+    result.update({
+        "population": population,
+        "initialization_seconds": initialization,
+        "loop_seconds": loop,
+        "person_months_per_second": population * data.SIM_MONTHS / loop,
+        "peak_rss_mb": peak_rss_mb(),
+    })
+    if data.ENGINE == "agent":
+        result["methods"] = bench_methods(model)
+    if data.ENGINE == "sharded":
+        # the largest shard worker, as the case's own figure leaves them out
+        result["shard_peak_rss_mb"] = peak_rss_mb(children=True)
+    return result
+
+
+def run_case(context, case, files):
+    # bench_case in a fresh process, so peak memory is not inherited; not in
+    # a Pool, whose daemonic workers could not start the shards' processes
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=send_case, args=(sender, case, files))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = None
+    process.join()
+    if result is None:
+        raise RuntimeError("benchmark case failed: %r" % case)
+    return result
+
+
+def send_case(connection, case, files):
+    connection.send(bench_case(case, files))
+    connection.close()
+
+
+def peak_rss_mb(children=False):
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def describe():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+    }
+
+
+def engine_label(case):
+    # the engine, with the number of shards of a sharded case
+    return case["engine"] if not case.get("shards") else f"{case['engine']}/{case['shards']}"
+
+
+def case_key(result):
+    return (result["engine"], result["cohort"], result["years"],
+            result["concurrency_male"], result["concurrency_female"], result.get("shards"))
+
+
+def compare(before_file, after_file):
+    with open(before_file) as f:
+        before = {case_key(r): r for r in json.load(f)["results"]}
+    with open(after_file) as f:
+        after = {case_key(r): r for r in json.load(f)["results"]}
+    print(f"{'engine':<10}{'cohort':>9}{'years':>6}{'conc m/f':>11}{'before pm/s':>14}{'after pm/s':>14}"
+          f"{'speedup':>9}{'rss ratio':>11}")
+    for key in sorted(set(before) & set(after)):
+        b, a = before[key], after[key]
+        rss = a["peak_rss_mb"] / b["peak_rss_mb"] if a["peak_rss_mb"] and b["peak_rss_mb"] else float("nan")
+        print(f"{engine_label(a):<10}{key[1]:>9}{key[2]:>6}{key[3]:>6}/{key[4]:<4}{b['person_months_per_second']:>14.0f}"
+              f"{a['person_months_per_second']:>14.0f}"
+              f"{a['person_months_per_second'] / b['person_months_per_second']:>9.2f}{rss:>11.2f}")
+
+
+def parse_concurrency(text):
+    male, female = text.split(":")
+    return float(male), float(female)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the sexual network model.")
+    parser.add_argument("--cohorts", type=int, nargs="+", default=[2000, 10000])
+    parser.add_argument("--years", type=int, nargs="+", default=[1, 3])
+    parser.add_argument("--concurrency", type=parse_concurrency, nargs="+", default=[(0.2, 0.05), (0.5, 0.2)],
+                        metavar="MALE:FEMALE")
+    parser.add_argument("--engines", nargs="+", default=["agent", "array"], choices=["agent", "array", "sharded"])
+    parser.add_argument("--shards", type=int, nargs="+", default=[2],
+                        help="SHARDS values to run --engines sharded with (default: 2)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="benchmark.json", help="where to write results (default: benchmark.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"),
+                        help="print the speedup between two result files instead of running")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    cases = [{"engine": engine, "shards": shards, "cohort": cohort, "years": years,
+              "concurrency_male": male, "concurrency_female": female, "seed": args.seed}
+             for engine, cohort, years, (male, female)
+             in itertools.product(args.engines, args.cohorts, args.years, args.concurrency)
+             for shards in (args.shards if engine == "sharded" else [None])]
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        files = write_fixtures(directory)
+        context = multiprocessing.get_context("spawn")
+        for case in cases:
+            result = run_case(context, case, files)
+            print(f"{engine_label(case):<10} cohort={case['cohort']:<8} years={case['years']:<3} "
+                  f"concurrency={case['concurrency_male']}/{case['concurrency_female']:<5} "
+                  f"{result['person_months_per_second']:>12.0f} person-months/s "
+                  f"{result['peak_rss_mb'] or 0:>8.1f} MB")
+            results.append(result)
+
+    with open(args.output, "w") as f:
+        json.dump({"meta": describe(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
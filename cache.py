@@ -0,0 +1,96 @@
+import os
+import glob
+import json
+import hashlib
+import numpy as np
+from tables import content_hash, atomic_write
+
+DEFAULT_RESULT_CACHE = "result_cache"
+# options that only say where things go, not what a run computes
+IGNORED_OPTIONS = {"RESULT_CACHE", "RESULT_CACHE_MB", "TABLE_CACHE", "RETENTION_BUFFER"}
+# the Python files whose contents make up the code version
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_code_version = None
+
+
+def code_version():
+    # hash of the model's source files, so results of other code are not reused
+    global _code_version
+    if _code_version is None:
+        digest = hashlib.sha256()
+        for filename in sorted(glob.glob(os.path.join(SOURCE_DIR, "*.py"))):
+            digest.update(os.path.basename(filename).encode())
+            digest.update(content_hash(filename).encode())
+        _code_version = digest.hexdigest()
+    return _code_version
+
+
+def job_key(params, seed, checkpoint=None, files=()):
+    """The cache key of one run.
+
+    A hash of its options, with the option names in files replaced by the
+    contents of the files they name, its np.random.SeedSequence, the
+    checkpoint it branches from and the code version.
+    """
+    options = {}
+    for name, value in params.items():
+        name = name.upper()
+        if name not in IGNORED_OPTIONS:
+            options[name] = content_hash(value) if name in files else value
+    state = {"options": options, "entropy": seed.entropy, "spawn_key": list(seed.spawn_key),
+             "checkpoint": None if checkpoint is None else content_hash(checkpoint), "code": code_version()}
+    return hashlib.sha256(json.dumps(state, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    """Finished runs stored as directory/<key>.npz, at most max_bytes of them.
+
+    Each entry holds a run's count arrays and its summary row. Reading an
+    entry marks it as used, and storing one evicts the least recently used
+    entries until the cache fits max_bytes again.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def load(self, key):
+        # (dict of count arrays, summary dict) stored under key, or None
+        path = self.path(key)
+        try:
+            with np.load(path) as stored:
+                arrays = {name: stored[name] for name in stored.files if name != "result"}
+                result = json.loads(str(stored["result"]))
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            # missing, evicted meanwhile or left half-written by a crash
+            return None
+        return arrays, result
+
+    def store(self, key, arrays, result):
+        os.makedirs(self.directory, exist_ok=True)
+        with atomic_write(self.path(key)) as f:
+            np.savez_compressed(f, result=json.dumps(result), **arrays)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, "*.npz")):
+            try:
+                status = os.stat(path)
+            except OSError:
+                continue
+            entries.append((status.st_mtime, status.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
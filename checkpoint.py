@@ -0,0 +1,23 @@
+import os
+import gzip
+import pickle
+
+
+def save_checkpoint(filename, model, job):
+    # job: dict with the run, section and replicate the model belongs to.
+    # Written to a temporary file and renamed, so a crash mid-write leaves
+    # the previous checkpoint intact. The gzip header gets no timestamp, so
+    # the same state always gives the same file (the result cache hashes it).
+    model.archive.flush()
+    temporary = filename + ".tmp"
+    with open(temporary, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=1, mtime=0) as f:
+        pickle.dump({"job": job, "model": model}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, filename)
+
+
+def load_checkpoint(filename):
+    # returns (job, model); the model's data, archive and random streams are
+    # exactly as they were when the checkpoint was written
+    with gzip.open(filename, "rb") as f:
+        state = pickle.load(f)
+    return state["job"], state["model"]
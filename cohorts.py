@@ -0,0 +1,152 @@
+import numpy as np
+from sexualnetwork import PartnerIndex
+
+# no current infections and none ever cleared
+UNINFECTED = ((), 0)
+
+
+class Cohort:
+    """People of one sex kept as counts instead of Woman/Man objects (HYBRID).
+
+    Everyone with the same month of age and infection state is
+    interchangeable, so the cohort maps (month_age, infections, cleared_mask)
+    to the number of people in that state. infections is a sorted tuple of
+    (HPVType.value, timer) pairs for the current infections, where timer is the
+    infection's Timer under CLEARANCE = monthly and its clearance month under
+    sampled. A month of mortality and clearance is a binomial draw per state.
+    """
+
+    def __init__(self, female):
+        self.female = female
+        self.counts = dict()
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def add(self, month_age, state=UNINFECTED, n=1):
+        if n:
+            key = (month_age,) + state
+            self.counts[key] = self.counts.get(key, 0) + n
+
+    def add_person(self, person, sampled):
+        infections = tuple(sorted((inf.Type.value, inf.ClearanceMonth if sampled else inf.Timer)
+                                  for inf in person.Infections.values()))
+        self.add(person.month_age, (infections, person.cleared_mask))
+
+    def take(self, month_age):
+        # remove the uninfected people of month_age and return how many there were
+        return self.counts.pop((month_age,) + UNINFECTED, 0)
+
+    def count_age(self, age):
+        # uninfected people aged age (children never have partners to infect them)
+        return sum(self.counts.get((m,) + UNINFECTED, 0) for m in range(12 * age, 12 * age + 12))
+
+    def take_one(self, age, u):
+        # remove one uniformly chosen uninfected person aged age, u uniform on
+        # [0, 1); returns their month of age
+        target = u * self.count_age(age)
+        for m in range(12 * age, 12 * age + 12):
+            key = (m,) + UNINFECTED
+            n = self.counts.get(key, 0)
+            if target < n:
+                if n == 1:
+                    del self.counts[key]
+                else:
+                    self.counts[key] = n - 1
+                return m
+            target -= n
+        raise ValueError("no one aged %d in the cohort" % age)
+
+    def natural_history(self, data, year, month):
+        """Mortality, this month's counts and clearance; returns the deaths as
+        archive records (PERSON_FIELDS)"""
+        if not self.counts:
+            return np.zeros((0, 6), dtype=np.int64)
+        keys = list(self.counts)
+        n = np.fromiter(self.counts.values(), dtype=np.int64, count=len(keys))
+        month_age = np.array([key[0] for key in keys])
+        masks = np.array([infection_mask(key[1]) for key in keys], dtype=np.int64)
+        cleared = np.array([key[2] for key in keys], dtype=np.int64)
+        ages = month_age // 12
+        mortality = data.MORTALITY_FEMALE if self.female else data.MORTALITY_MALE
+        dead = data.rng.demography.generator.binomial(n, mortality[ages])
+        survivors = n - dead
+        data.count_survivors(year, self.female, ages, masks, survivors)
+        if data.network is not None:
+            data.network.count_degrees(year, self.female, ages, 0, survivors)
+
+        self.counts = dict()
+        generator = data.rng.transmission.generator
+        for key, count in zip(keys, survivors.tolist()):
+            if not count:
+                continue
+            if not key[1]:
+                self.counts[key] = self.counts.get(key, 0) + count
+                continue
+            for state, m in clear(key[1], key[2], count, data, month, generator):
+                self.add(key[0], state, m)
+
+        died = dead > 0
+        return np.repeat(np.column_stack([
+            np.full(died.sum(), month), np.full(died.sum(), self.female), ages[died], month_age[died],
+            masks[died], cleared[died]]), dead[died], axis=0).astype(np.int64)
+
+    def age(self):
+        # everyone is a month older
+        self.counts = {(key[0] + 1,) + key[1:]: n for key, n in self.counts.items()}
+
+
+def infection_mask(infections):
+    mask = 0
+    for hpv, _ in infections:
+        mask |= 1 << hpv
+    return mask
+
+
+def clear(infections, cleared, n, data, month, generator):
+    # split n people with the same infections into their states after this
+    # month's clearance, as ((infections, cleared_mask), count) pairs
+    groups = {((), cleared): n}
+    for hpv, timer in infections:
+        after = dict()
+        for (kept, mask), m in groups.items():
+            if data.CLEARANCE == "sampled":
+                cleared_now = m if timer <= month else 0
+                still = (hpv, timer)
+            else:
+                hazard = data.CLEARANCE_HAZARD
+                cleared_now = generator.binomial(m, hazard[min(timer, len(hazard) - 1), hpv])
+                still = (hpv, timer + 1)
+            for state, count in (((kept + (still,), mask), m - cleared_now), ((kept, mask | 1 << hpv), cleared_now)):
+                if count:
+                    after[state] = after.get(state, 0) + count
+        groups = after
+    return groups.items()
+
+
+class CohortPartnerIndex(PartnerIndex):
+    """A PartnerIndex that also offers the boys still kept in a Cohort.
+
+    Women can choose partners younger than SEXUAL_DEBUT_AGE. A boy in the
+    cohort is single, so the first one reached in the random order is always
+    accepted; he is made a Man by recruit(age, month_age) and returned.
+    """
+
+    def __init__(self, cohort, recruit):
+        super().__init__()
+        self.cohort = cohort
+        self.recruit = recruit
+
+    def candidates(self, age, rng):
+        waiting = self.cohort.count_age(age)
+        men = super().candidates(age, rng)
+        if not waiting:
+            yield from men
+            return
+        # in a random order of the men and the waiting boys, the next one is a
+        # waiting boy with probability waiting / (waiting + men left)
+        for left in range(len(self.buckets[age]), -1, -1):
+            if rng.random() * (waiting + left) < waiting:
+                yield self.recruit(age, self.cohort.take_one(age, rng.random()))
+                return
+            yield next(men)
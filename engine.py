@@ -0,0 +1,506 @@
+import numpy as np
+from sexualnetwork import HPVType, PartnershipType, MAX_PARTNER_AGE, SEED_TYPES, seed_counts, transmission_probability
+from profiling import NullProfiler
+
+N_TYPES = len(HPVType)
+MAX_ACTIVE_AGE = 74
+# candidates drawn per partner search before the rest of an age bucket is shuffled
+SAMPLE_SIZE = 16
+
+# HPVType.mask of each type column, to turn infection arrays into bitmasks
+TYPE_MASKS = np.array([t.mask for t in HPVType])
+NULL_PROFILER = NullProfiler()
+
+
+class Population:
+    """Struct-of-arrays store for every person in one model run.
+
+    Slots are never freed: a person who dies is replaced in place by a newborn
+    of the same sex, exactly as main.py swaps a dead Woman/Man for a new one.
+    """
+
+    def __init__(self, female, age, data):
+        self.size = len(age)
+        self.female = np.asarray(female, dtype=bool)
+        self.age = np.asarray(age, dtype=np.int16)
+        self.month_age = self.age.astype(np.int32) * 12
+        self.alive = np.ones(self.size, dtype=bool)
+        self.numpartners = np.zeros(self.size, dtype=np.int32)
+        self.concurrency = np.where(self.female, data.CONCURRENCY_FEMALE, data.CONCURRENCY_MALE)
+        self.infected = np.zeros((self.size, N_TYPES), dtype=bool)
+        self.cleared = np.zeros((self.size, N_TYPES), dtype=bool)
+        # months infected, or with CLEARANCE = sampled the month of clearance
+        self.timer = np.zeros((self.size, N_TYPES), dtype=np.int32)
+
+    def reset(self, idx):
+        """Replace the people at idx with newborns of the same sex"""
+        self.age[idx] = 0
+        self.month_age[idx] = 0
+        self.alive[idx] = True
+        self.numpartners[idx] = 0
+        self.infected[idx] = False
+        self.cleared[idx] = False
+        self.timer[idx] = 0
+
+
+class PartnershipTable:
+    """Preallocated column store for the partnerships of an ArrayEngine.
+
+    Each partnership occupies a slot. A dissolved partnership's slot goes on a
+    free list and is reused by the next one formed, and the columns double
+    when every slot is taken. Each person's partnerships are chained through
+    the slots from head[person], so a pair is looked up by walking one
+    person's few partnerships.
+    """
+
+    def __init__(self, people, capacity=1024):
+        self.head = np.full(people, -1, dtype=np.int32)
+        self.capacity = 0
+        self.female = np.empty(0, dtype=np.int64)
+        self.male = np.empty(0, dtype=np.int64)
+        self.type = np.empty(0, dtype=np.int8)
+        self.start = np.empty(0, dtype=np.int32)
+        self.maxdur = np.empty(0, dtype=np.int32)
+        self.sexacts = np.empty(0, dtype=np.int32)
+        self.active = np.empty(0, dtype=bool)
+        # neighbours in the woman's and in the man's chain, -1 at either end
+        self.next_female = np.empty(0, dtype=np.int32)
+        self.prev_female = np.empty(0, dtype=np.int32)
+        self.next_male = np.empty(0, dtype=np.int32)
+        self.prev_male = np.empty(0, dtype=np.int32)
+        # free slots, the next to be used last
+        self.free = np.empty(0, dtype=np.int32)
+        self.n_free = 0
+        self.grow(capacity)
+
+    def __len__(self):
+        return self.capacity - self.n_free
+
+    def grow(self, capacity):
+        added = capacity - self.capacity
+        for name in ("female", "male", "type", "start", "maxdur", "sexacts", "active",
+                     "next_female", "prev_female", "next_male", "prev_male"):
+            column = getattr(self, name)
+            setattr(self, name, np.concatenate([column, np.zeros(added, dtype=column.dtype)]))
+        free = np.empty(capacity, dtype=np.int32)
+        free[:self.n_free] = self.free[:self.n_free]
+        free[self.n_free:self.n_free + added] = np.arange(capacity - 1, self.capacity - 1, -1)
+        self.free = free
+        self.n_free += added
+        self.capacity = capacity
+
+    def slots(self):
+        """The slots of the active partnerships, in slot order"""
+        return np.flatnonzero(self.active)
+
+    def add(self, female, male, ptype, start, maxdur, sexacts):
+        n = len(female)
+        if n > self.n_free:
+            self.grow(max(2 * self.capacity, self.capacity + n - self.n_free))
+        slots = self.free[self.n_free - n:self.n_free][::-1].copy()
+        self.n_free -= n
+        self.female[slots] = female
+        self.male[slots] = male
+        self.type[slots] = ptype
+        self.start[slots] = start
+        self.maxdur[slots] = maxdur
+        self.sexacts[slots] = sexacts
+        self.active[slots] = True
+        self.link(slots, female, self.next_female, self.prev_female)
+        self.link(slots, male, self.next_male, self.prev_male)
+        return slots
+
+    def remove(self, slots):
+        # runs of removed slots next to each other in a chain are cut out together
+        gone = np.zeros(self.capacity + 1, dtype=bool)
+        gone[slots] = True
+        self.unlink(slots, self.female[slots], self.next_female, self.prev_female, gone)
+        self.unlink(slots, self.male[slots], self.next_male, self.prev_male, gone)
+        self.active[slots] = False
+        self.free[self.n_free:self.n_free + len(slots)] = slots
+        self.n_free += len(slots)
+
+    def link(self, slots, people, nxt, prev):
+        # put slots at the front of their people's chains, in slot order
+        if len(slots) == 0:
+            return
+        order = np.argsort(people, kind="stable")
+        slots, people = slots[order], people[order]
+        first = np.ones(len(slots), dtype=bool)
+        first[1:] = people[1:] != people[:-1]
+        last = np.append(first[1:], True)
+        nxt[slots[:-1]] = slots[1:]
+        prev[slots[1:]] = slots[:-1]
+        old = self.head[people[last]]
+        nxt[slots[last]] = old
+        prev[slots[first]] = -1
+        prev[old[old >= 0]] = slots[last][old >= 0]
+        self.head[people[first]] = slots[first]
+
+    def unlink(self, slots, people, nxt, prev, gone):
+        # gone marks the removed slots, with a False after the last slot so
+        # that indexing it with -1 (no neighbour) reads as kept
+        before = prev[slots]
+        starts = ~gone[before]
+        before, people = before[starts], people[starts]
+        after = nxt[slots[starts]]
+        skip = gone[after]
+        while skip.any():
+            after[skip] = nxt[after[skip]]
+            skip = gone[after]
+        linked = before >= 0
+        nxt[before[linked]] = after[linked]
+        self.head[people[~linked]] = after[~linked]
+        prev[after[after >= 0]] = before[after >= 0]
+
+    def linked(self, woman, man):
+        """Whether woman and man are already partners"""
+        slot = self.head[woman]
+        while slot >= 0:
+            if self.male[slot] == man:
+                return True
+            slot = self.next_female[slot]
+        return False
+
+    def partners(self, person, female):
+        """The slots of person's partnerships"""
+        nxt = self.next_female if female else self.next_male
+        slots = []
+        slot = self.head[person]
+        while slot >= 0:
+            slots.append(int(slot))
+            slot = nxt[slot]
+        return slots
+
+
+class ArrayEngine:
+    """Runs the monthly cycle of main.py over a Population instead of Woman/Man objects.
+
+    Results are accumulated into the same Data counters, so Data.write_infections
+    produces files that can be compared directly with the agent model.
+    """
+
+    def __init__(self, data, archive=None):
+        self.data = data
+        self.archive = archive
+        self.month = 0
+        self.year = 0
+        self.n_ages = data.N_AGES
+        self.population = None
+        self.refresh_parameters()
+        self.population = self.initialize()
+        self.partnerships = self.partnership_table()
+        self.seed_infections()
+
+    def partnership_table(self):
+        return PartnershipTable(self.population.size)
+
+    def refresh_parameters(self):
+        # generators and derived lookup arrays; rebuilt after data.update()
+        # loads a new section
+        data = self.data
+        # vector draws come straight from the Generators of data.rng
+        self.demography = data.rng.demography.generator
+        self.partnering = data.rng.partnering.generator
+        self.transmission = data.rng.transmission.generator
+        self.clearance = data.CLEARANCE_HAZARD
+        # the CDF rows laid end to end, row k shifted up by k, so one
+        # searchsorted inverts a whole batch of draws for mixed ages
+        cdf = data.PARTNER_AGE_CDF
+        self.partner_age_cdf = (cdf + np.arange(len(cdf))[:, None]).ravel()
+        self.formation_female = data.FORMATION_FEMALE
+        self.immunity = np.array([
+            data.NATURAL_IMMUNITY_HPV16,
+            data.NATURAL_IMMUNITY_HPV18,
+            data.NATURAL_IMMUNITY_HPVoHR,
+            data.NATURAL_IMMUNITY_HPVLR])
+        # (average duration in years, sex acts per month) by PartnershipType value
+        self.partnership_means = {
+            PartnershipType.MARITAL.value: (data.DUR_MARITAL, data.SEX_PER_MONTH_MARITAL),
+            PartnershipType.SHORT_TERM.value: (data.DUR_SHORT_TERM, data.SEX_PER_MONTH_SHORT_TERM),
+            PartnershipType.CASUAL.value: (data.DUR_CASUAL, data.SEX_PER_MONTH_CASUAL),
+            PartnershipType.INSTANTANEOUS.value: (0, 1)}
+        if self.population is not None:
+            pop = self.population
+            pop.concurrency = np.where(pop.female, data.CONCURRENCY_FEMALE, data.CONCURRENCY_MALE)
+
+    def initialize(self):
+        num_women, num_men = self.data.initial_numbers()
+        ages = np.arange(self.n_ages)
+        age = np.concatenate([np.repeat(ages, num_women), np.repeat(ages, num_men)])
+        female = np.concatenate([np.ones(num_women.sum(), dtype=bool), np.zeros(num_men.sum(), dtype=bool)])
+        return Population(female, age, self.data)
+
+    def seed_infections(self):
+        # slots are laid out by sex and age, so the first people of each age
+        # take that age's multinomial seed counts
+        num_women, num_men = self.data.initial_numbers()
+        starts = np.concatenate([[0], np.cumsum(np.concatenate([num_women, num_men]))[:-1]])
+        counts = np.concatenate([seed_counts(num_women, self.transmission), seed_counts(num_men, self.transmission)])
+        offsets = np.cumsum(counts, axis=1) - counts
+        for k, hpv in enumerate(SEED_TYPES):
+            idx = np.repeat(starts + offsets[:, k], counts[:, k]) + ragged_range(counts[:, k])
+            self.acquire_infections(idx, hpv.value)
+
+    def run(self):
+        while self.month < self.data.SIM_MONTHS:
+            self.step()
+
+    def step(self, profiler=NULL_PROFILER):
+        pop = self.population
+        month = self.month
+        profiler.start()
+        existing = len(self.partnerships)
+        attempted = self.data.transmissions_attempted
+
+        self.natural_history(np.flatnonzero(pop.female), self.data.MORTALITY_FEMALE)
+        self.form_partnerships()
+        profiler.lap("female")
+        self.natural_history(np.flatnonzero(~pop.female), self.data.MORTALITY_MALE)
+        self.data.next_clearance_month = month + 1
+        profiler.lap("male")
+        formed = len(self.partnerships) - existing
+        ending = self.check_relationships()
+        profiler.lap("relationships")
+        self.remove_dissolved(ending)
+        profiler.lap("cleanup")
+        self.age_population()
+        profiler.lap("aging")
+
+        profiler.count(formed=formed, dissolved=len(ending), population=pop.size,
+                       transmissions=self.data.transmissions_attempted - attempted)
+        profiler.end_month(month)
+
+    # Demography and infection natural history
+
+    def natural_history(self, idx, mortality):
+        pop = self.population
+        dies = self.demography.random(len(idx)) < mortality[pop.age[idx]]
+        pop.alive[idx[dies]] = False
+        survivors = idx[~dies]
+        self.count_survivors(survivors)
+        self.clear_infections(survivors)
+
+    def count_survivors(self, idx):
+        pop = self.population
+        self.data.count_survivors(self.year, pop.female[idx], pop.age[idx], pop.infected[idx] @ TYPE_MASKS)
+        if self.data.network is not None:
+            self.data.network.count_degrees(self.year, pop.female[idx], pop.age[idx], self.degrees()[idx])
+
+    def degrees(self):
+        # everyone's number of partnerships, including any ending this month
+        ps = self.partnerships
+        slots = ps.slots()
+        size = self.population.size
+        return np.bincount(ps.female[slots], minlength=size) + np.bincount(ps.male[slots], minlength=size)
+
+    def clear_infections(self, idx):
+        pop = self.population
+        rows, types = np.nonzero(pop.infected[idx])
+        people = idx[rows]
+        if self.data.CLEARANCE == "sampled":
+            clear = pop.timer[people, types] <= self.month
+        else:
+            timer = np.minimum(pop.timer[people, types], len(self.clearance) - 1)
+            clear = self.transmission.random(len(people)) < self.clearance[timer, types]
+            pop.timer[people[~clear], types[~clear]] += 1
+        pop.infected[people[clear], types[clear]] = False
+        pop.cleared[people[clear], types[clear]] = True
+
+    def acquire_infections(self, idx, hpv):
+        pop = self.population
+        pop.infected[idx, hpv] = True
+        if self.data.CLEARANCE == "sampled":
+            checks = self.data.clearance_checks(hpv, self.transmission.random(len(idx)))
+            pop.timer[idx, hpv] = np.minimum(self.data.next_clearance_month + checks, np.iinfo(np.int32).max)
+        else:
+            pop.timer[idx, hpv] = 1
+        self.data.count_incidence(self.year, pop.female[idx], hpv, pop.age[idx])
+
+    def age_population(self):
+        pop = self.population
+        alive = pop.alive
+        pop.month_age[alive] += 1
+        pop.age[alive & (pop.month_age % 12 == 0)] += 1
+        dead = np.flatnonzero(~alive)
+        if self.archive is not None and len(dead) > 0:
+            self.archive.add_deaths(self.death_records(dead))
+        pop.reset(dead)
+        self.month += 1
+        if self.month % 12 == 0:
+            self.year += 1
+
+    def death_records(self, dead):
+        pop = self.population
+        return np.column_stack([
+            np.full(len(dead), self.month), pop.female[dead], pop.age[dead], pop.month_age[dead],
+            pop.infected[dead] @ TYPE_MASKS, pop.cleared[dead] @ TYPE_MASKS]).astype(np.int64)
+
+    # Partnerships
+
+    def partner_ages(self, ages):
+        # one uniform per woman, inverted through her age's row of the CDF
+        ages = ages.astype(np.intp)
+        u = self.partnering.random(len(ages))
+        return np.searchsorted(self.partner_age_cdf, ages + u, side="right") - ages * (MAX_PARTNER_AGE + 1)
+
+    def find_partner(self, woman, bucket):
+        # Walk the bucket in random order until a man is eligible and willing.
+        # A small sample without replacement is almost always enough; the rest
+        # of the bucket is only shuffled when the whole sample refuses.
+        sample = self.partnering.choice(len(bucket), size=min(len(bucket), SAMPLE_SIZE), replace=False)
+        man = self.first_willing(woman, bucket[sample])
+        if man is None and len(bucket) > SAMPLE_SIZE:
+            rest = np.delete(bucket, sample)
+            man = self.first_willing(woman, rest[self.partnering.permutation(len(rest))])
+        return man
+
+    def first_willing(self, woman, candidates):
+        pop = self.population
+        accept = (pop.numpartners[candidates] == 0) | (self.partnering.random(len(candidates)) < pop.concurrency[candidates])
+        for man in candidates[accept].tolist():
+            if not self.partnerships.linked(woman, man):
+                return man
+        return None
+
+    def partnership_type(self, single):
+        data = self.data
+        rand = self.data.rng.partnering.random()
+        if single:
+            if rand < data.PROB_CASUAL:
+                return PartnershipType.CASUAL
+            elif rand < (data.PROB_CASUAL + data.PROB_MARITAL):
+                return PartnershipType.MARITAL
+            elif rand < (data.PROB_CASUAL + data.PROB_MARITAL + data.PROB_SHORT_TERM):
+                return PartnershipType.SHORT_TERM
+            else:
+                return PartnershipType.INSTANTANEOUS
+        elif rand < data.PROB_CASUAL:
+            return PartnershipType.CASUAL
+        else:
+            return PartnershipType.INSTANTANEOUS
+
+    def form_partnerships(self):
+        seekers = self.seekers(np.flatnonzero(self.population.female))
+        men, bounds = self.men_by_age()
+        self.add_partnerships(*self.match(seekers, men, bounds))
+
+    def seekers(self, women):
+        # the women among women who look for a partner this month
+        pop = self.population
+        data = self.data
+        age = pop.age[women]
+        women = women[pop.alive[women] & (age >= data.SEXUAL_DEBUT_AGE) & (age <= MAX_ACTIVE_AGE)]
+        threshold = np.where(pop.numpartners[women] == 0, self.formation_female[pop.age[women]], data.CONCURRENCY_FEMALE)
+        return women[self.partnering.random(len(women)) < threshold]
+
+    def men_by_age(self):
+        # men are bucketed by age once; nobody ages or dies during this phase
+        pop = self.population
+        men = np.flatnonzero(~pop.female)
+        men = men[np.argsort(pop.age[men], kind="stable")]
+        bounds = np.searchsorted(pop.age[men], np.arange(MAX_PARTNER_AGE + 2))
+        return men, bounds
+
+    def match(self, seekers, men, bounds, partner_ages=None):
+        # a partner and partnership type for each seeker who finds one, of the
+        # age drawn for her unless partner_ages are given
+        pop = self.population
+        if partner_ages is None:
+            partner_ages = self.partner_ages(pop.age[seekers])
+        # a draw of an age nobody has finds no partner; skip it without a search
+        found = bounds[partner_ages + 1] > bounds[partner_ages]
+        seekers, partner_ages = seekers[found], partner_ages[found]
+        new_female, new_male, new_type = [], [], []
+        for woman, partner_age in zip(seekers.tolist(), partner_ages.tolist()):
+            man = self.find_partner(woman, men[bounds[partner_age]:bounds[partner_age + 1]])
+            if man is None:
+                continue
+            ptype = self.partnership_type(pop.numpartners[man] == 0)
+            # Woman.create_partnership counts each new partnership twice
+            pop.numpartners[woman] += 2
+            pop.numpartners[man] += 2
+            new_female.append(woman)
+            new_male.append(man)
+            new_type.append(ptype.value)
+        return (np.array(new_female, dtype=np.int64), np.array(new_male, dtype=np.int64),
+                np.array(new_type, dtype=np.int8))
+
+    def add_partnerships(self, female, male, ptype):
+        if len(ptype):
+            means = np.array([self.partnership_means[t] for t in ptype.tolist()])
+            self.partnerships.add(female, male, ptype, self.month, 12 * self.partnering.poisson(means[:, 0]),
+                                  self.partnering.poisson(means[:, 1]))
+            if self.data.network is not None:
+                pop = self.population
+                self.data.network.add_partnerships(self.year, pop.age[female], pop.age[male], ptype)
+
+    def check_relationships(self):
+        # returns the slots of the partnerships that end this month
+        ps = self.partnerships
+        live = self.live_partnerships()
+        female, male, sexacts = ps.female[live], ps.male[live], ps.sexacts[live]
+        self.transmit(male, female, sexacts)
+        self.transmit(female, male, sexacts)
+        return self.ending_partnerships()
+
+    def live_partnerships(self):
+        # the slots of the active partnerships whose partners are both alive
+        pop = self.population
+        ps = self.partnerships
+        slots = ps.slots()
+        return slots[pop.alive[ps.female[slots]] & pop.alive[ps.male[slots]]]
+
+    def ending_partnerships(self):
+        # partnerships end when they reach maxdur or when a partner has died;
+        # one formed this month has lasted a month
+        pop = self.population
+        ps = self.partnerships
+        slots = ps.slots()
+        both_alive = pop.alive[ps.female[slots]] & pop.alive[ps.male[slots]]
+        return slots[~both_alive | (self.month - ps.start[slots] + 1 >= ps.maxdur[slots])]
+
+    def remove_dissolved(self, ending):
+        pop = self.population
+        ps = self.partnerships
+        if self.archive is not None and len(ending) > 0:
+            self.archive.add_dissolutions(self.dissolution_records(ending))
+        if self.data.network is not None:
+            self.data.network.end_partnerships(self.year, pop.age[ps.female[ending]], pop.age[ps.male[ending]],
+                                               ps.type[ending], self.month - ps.start[ending] + 1)
+        np.subtract.at(pop.numpartners, ps.female[ending], 1)
+        np.subtract.at(pop.numpartners, ps.male[ending], 1)
+        ps.remove(ending)
+
+    def dissolution_records(self, ending):
+        ps = self.partnerships
+        return np.column_stack([
+            np.full(len(ending), self.month), ps.type[ending], self.month - ps.start[ending] + 1,
+            ps.maxdur[ending], ps.sexacts[ending]]).astype(np.int64)
+
+    def transmit(self, source, target, sexacts):
+        self.acquire_coded(self.infect(source, target, sexacts))
+
+    def infect(self, source, target, sexacts):
+        # one draw per discordant partnership and type for the whole month;
+        # returns the infections passed on, coded as person * N_TYPES + type
+        pop = self.population
+        rows, types = np.nonzero(pop.infected[source] & ~pop.infected[target])
+        self.data.transmissions_attempted += len(rows)
+        receivers = target[rows]
+        per_act = self.data.TRANSMISSION_PER_SEX_ACT * np.where(pop.cleared[receivers, types], self.immunity[types], 1.0)
+        hit = self.transmission.random(len(rows)) < transmission_probability(per_act, sexacts[rows])
+        return receivers[hit] * N_TYPES + types[hit]
+
+    def acquire_coded(self, acquired):
+        # several partners can pass on the same type in one month; it is acquired once
+        acquired = np.unique(acquired)
+        for hpv in range(N_TYPES):
+            self.acquire_infections(acquired[acquired % N_TYPES == hpv] // N_TYPES, hpv)
+
+
+def ragged_range(counts):
+    # concatenated arange(c) for each c in counts
+    counts = np.asarray(counts)
+    ends = np.cumsum(counts)
+    return np.arange(ends[-1] if len(ends) else 0) - np.repeat(ends - counts, counts)
@@ -1,129 +1,285 @@
-import sys
-import uuid
+import os
+import csv
+import time
+import argparse
 import configparser
-from sexualnetwork import Data, Woman, Man, Individual, Timer
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from sexualnetwork import Data, Timer, TABLE_FILES, COUNT_ARRAYS, shard_count
+from agent import AgentModel
+from engine import ArrayEngine
+from shards import ShardedEngine
+from archive import Archive
+from checkpoint import save_checkpoint, load_checkpoint
+from rng import RandomStreams
+from tables import read_table, DEFAULT_TABLE_CACHE
+from profiling import make_profiler, NullProfiler
+from output import ResultStore, totals, month_summary
+from cache import ResultCache, job_key, DEFAULT_RESULT_CACHE
 
 
-def main():
-    if len(sys.argv) > 1:
-        filename = sys.argv[1]
-    else:
-        filename = "example.ini"
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the sexual network model for every section of an ini file.")
+    parser.add_argument("filename", nargs="?", default=None, help="model ini file (default: example.ini)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes to spread section x replicate jobs over (default: 1)")
+    parser.add_argument("--resume", metavar="CHECKPOINT",
+                        help="continue the run saved in CHECKPOINT; with an ini file, start every "
+                             "section of it from the checkpointed population instead")
+    parser.add_argument("--force", action="store_true",
+                        help="rerun every job even when RESULT_CACHE has its results (and store the new ones)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
 
-    # create a dataset for each model run
+    if args.resume is not None and args.filename is None:
+        result = resume_job(args.resume)
+        write_summary("summary_" + result["run"] + ".csv", [result])
+        return
+
+    # create one job for each replicate of each model run
     # (i.e., section of ini file)
-    model_data = []
+    filename = args.filename or "example.ini"
     config = configparser.ConfigParser()
     config.read(filename)
-    sections = config.sections()
-    for section in sections:
-        model_data.append(Data(config[section]))
-
-    for run in range(len(model_data)):
-        # loop through all model runs
-        # Create dictionary of men, women and partnerships
-        women = dict()
-        men = dict()
-        dead_women = dict()
-        dead_men = dict()
-        partnerships = dict()
-        inactive_partnerships = dict()
-        lookup_table = dict()
-
-        # Initialize men and women
-
-        num_men = []
-        num_women = []
-        model_ages = model_data[run].INITIAL_POPULATION.shape[0]
-
-        for k in range(model_ages):
-            num_men.append(int(model_data[run].INITIAL_POPULATION.iloc[k]["MALE"] * model_data[run].COHORT_SIZE))
-            num_women.append(int(model_data[run].INITIAL_POPULATION.iloc[k]["FEMALE"] * model_data[run].COHORT_SIZE))
-
-        age = 0
-        for x in num_women:
-            for _ in range(x):
-                woman_id = uuid.uuid1()
-                women[woman_id] = Woman(age, woman_id, model_data[run])
-                women[woman_id].seed_infection()  # Seed HPV
-            age += 1
-
-        age = 0
-        for x in num_men:
-            lookup_table[age] = dict()
-            for _ in range(x):
-                man_id = uuid.uuid1()
-                men[man_id] = Man(age, man_id, model_data[run])
-                lookup_table[age][man_id] = men[man_id]
-                men[man_id].seed_infection()  # Seed HPV
-            age += 1
-
-        # Run simulation
-
-        t = Timer()
-        t.start()
-
-        for month in range(model_data[run].SIM_MONTHS):
-
-            for _, w in women.items():
-                w.natural_history()
-                if w.alive:
-                    w.run_partnerships(lookup_table, partnerships)
-
-            for _, m in men.items():
-                m.natural_history()
-
-            for _, p in partnerships.items():
-                p.check_relationships()
-
-            partnerships_to_delete = [keys for keys in partnerships if not partnerships[keys].active]
-
-            for key in partnerships_to_delete:
-                inactive_partnerships[key] = partnerships[key]
-                del partnerships[key]
-
-            women_to_delete = []
-
-            for j, w in women.items():
-                if w.alive:
-                    w.month_age += 1
-                    if w.month_age % 12 == 0:
-                        w.age += 1
-                else:
-                    dead_women[j] = w
-                    women_to_delete.append(j)
-
-            for key in women_to_delete:
-                del women[key]
-                woman_id = uuid.uuid1()
-                women[woman_id] = Woman(0, woman_id, model_data[run])
-
-            men_to_delete = []
-
-            for j, m in men.items():
-                if m.alive:
-                    m.month_age += 1
-                    if m.month_age % 12 == 0:
-                        m.age += 1
-                        lookup_table[m.age][j] = m
-                        del lookup_table[m.age - 1][j]
-                else:
-                    dead_men[j] = m
-                    men_to_delete.append(j)
-                    del lookup_table[m.age][j]
-
-            for key in men_to_delete:
-                del men[key]
-                man_id = uuid.uuid1()
-                men[man_id] = Man(0, man_id, model_data[run])
-                lookup_table[0][man_id] = men[man_id]
-
-            Individual.month += 1
-            if Individual.month % 12 == 0:
-                Individual.year += 1
-
-        t.stop()
-        model_data[run].write_infections(sections[run])
+    jobs = []
+    for section in config.sections():
+        jobs.extend(make_jobs(section, config[section], args.resume))
+
+    if args.workers > 1:
+        warm_table_cache(config[section] for section in config.sections())
+    results = run_jobs(jobs, args.workers, partial(run_job, force=True) if args.force else None)
+    write_summary("summary_" + os.path.splitext(os.path.basename(filename))[0] + ".csv", results)
+
+
+def warm_table_cache(sections):
+    # parse the input tables once here, so the workers only map the cached copies
+    for params in sections:
+        cache = params.get("TABLE_CACHE", DEFAULT_TABLE_CACHE)
+        for key in TABLE_FILES:
+            if cache and key in params:
+                read_table(params[key], cache)
+
+
+def run_jobs(jobs, workers=1, run=None):
+    # run (default run_job) on every job, over a process pool when workers > 1
+    run = run or run_job
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(run, jobs))
+    return [run(job) for job in jobs]
+
+
+def make_jobs(section, params, checkpoint=None):
+    # Seeds are spawned here rather than in the workers, so every replicate
+    # gets the same stream whatever the number of workers
+    replicates = int(params.get("REPLICATES", "1"))
+    seed = params.get("SEED")
+    root = np.random.SeedSequence(None if seed is None else int(seed))
+    return [(section, dict(params), replicate, child, checkpoint)
+            for replicate, child in enumerate(root.spawn(replicates))]
+
+
+def run_job(job, stop=None, force=False):
+    # a run cut short by stop depends on stop, so it is never cached
+    cached = None if stop is not None else job_cache(job)
+    if cached is not None and not force:
+        result = load_cached(*cached, job)
+        if result is not None:
+            return result
+    model, job = start_job(job)
+    result = run_model(model, job, stop)
+    if cached is not None:
+        cache, key = cached
+        cache.store(key, stored_arrays(model.data), result)
+    return result
+
+
+def job_cache(job):
+    """(cache, key) for a job whose results can be reused, else None.
+
+    Only runs with a SEED whose outputs are the incidence and prevalence
+    files (and RESULTS_DIR) qualify; RETENTION = counts or log, checkpoints
+    and profiles are written while the model runs, so those always run.
+    The key comes from the options and input files alone, without loading
+    the tables into a Data.
+    """
+    seed, checkpoint = job[3:]
+    params = job_section(job)
+    directory = params.get("RESULT_CACHE", DEFAULT_RESULT_CACHE)
+    if (not directory or params.get("SEED") is None or params.get("RETENTION", "keep") in ("counts", "log")
+            or int(params.get("CHECKPOINT_INTERVAL", "0"))
+            or params.getboolean("PROFILE", fallback=False)):
+        return None
+    cache = ResultCache(directory, float(params.get("RESULT_CACHE_MB", "1024")) * 2 ** 20)
+    options = dict(params)
+    if params.get("ENGINE") == "sharded":
+        # sharded results depend on the number of shards, which for SHARDS = 0
+        # is the machine's CPU count (options are lowercase, as configparser keeps them)
+        options["shards"] = str(shard_count(params.get("SHARDS", "0")))
+    return cache, job_key(options, seed, checkpoint, TABLE_FILES)
+
+
+def stored_arrays(data):
+    # the arrays a cached run's outputs are written from
+    arrays = {name: getattr(data, name) for name in COUNT_ARRAYS}
+    if data.network is not None:
+        arrays.update(("network_" + name, getattr(data.network, name)) for name in data.network.ARRAYS)
+    return arrays
+
+
+def load_cached(cache, key, job):
+    # write the outputs of a cached run from its stored counts, under job's
+    # own run name since other sections may share the key; returns its
+    # summary, or None when key is not in the cache
+    start = time.perf_counter()
+    stored = cache.load(key)
+    if stored is None:
+        return None
+    arrays, result = stored
+    data = Data(job_section(job))
+    names = job_names(job)
+    for name, values in arrays.items():
+        if name.startswith("network_"):
+            setattr(data.network, name[len("network_"):], values)
+        else:
+            setattr(data, name, values)
+    run = names["run"]
+    data.write_infections(run)
+    if data.network is not None:
+        data.network.write(run, data.SEXUAL_DEBUT_AGE)
+    if data.RESULTS_DIR:
+        ResultStore(data.RESULTS_DIR, run).write_completed(data, 12 * data.alive_counts.shape[-1])
+    result.update(names)
+    result.update(seconds=round(time.perf_counter() - start, 4), cached=True)
+    return result
+
+
+def job_names(job):
+    # the run, section and replicate a job belongs to
+    section, _, replicate, _, _ = job
+    run = section if int(job_section(job).get("REPLICATES", "1")) == 1 else section + "_" + str(replicate)
+    return {"run": run, "section": section, "replicate": replicate}
+
+
+def job_section(job):
+    # a job's options as a configparser section, which Data reads
+    section, params = job[:2]
+    parser = configparser.ConfigParser()
+    parser.read_dict({section: params})
+    return parser[section]
+
+
+def start_job(job):
+    # the model of one job and the run, section and replicate it belongs to
+    seed, checkpoint = job[3:]
+    params = job_section(job)
+    names = job_names(job)
+    run = names["run"]
+
+    if checkpoint is None:
+        data = Data(params)
+        data.rng = RandomStreams(seed, data.RNG_BLOCK_SIZE)
+        archive = Archive(data.RETENTION, run, data.N_AGES, data.RETENTION_BUFFER)
+        model = make_model(data, archive)
+    else:
+        # branch from a checkpointed population with this section's parameters
+        _, model = load_checkpoint(checkpoint)
+        data = model.data
+        data.update(params)
+        data.rng = RandomStreams(seed, data.RNG_BLOCK_SIZE)
+        model.archive = Archive(data.RETENTION, run, data.N_AGES, data.RETENTION_BUFFER)
+        model.refresh_parameters()
+
+    return model, names
+
+
+def resume_job(checkpoint):
+    job, model = load_checkpoint(checkpoint)
+    model.archive.resume()
+    return run_model(model, job)
+
+
+def make_model(data, archive):
+    if data.ENGINE == "array":
+        return ArrayEngine(data, archive)
+    if data.ENGINE == "sharded":
+        return ShardedEngine(data, archive)
+    return AgentModel(data, archive)
+
+
+def simulate(model, job, profiler=None):
+    """Step model to the end of the run, yielding a summary dict of each month.
+
+    Checkpoints are written every CHECKPOINT_INTERVAL months and, when
+    RESULTS_DIR is set, each year's counts are streamed there as it ends.
+    """
+    data = model.data
+    run = job["run"]
+    profiler = profiler or NullProfiler()
+    store = ResultStore(data.RESULTS_DIR, run) if data.RESULTS_DIR else None
+    before = totals(data, model.month // 12) if model.month < data.SIM_MONTHS else None
+    while model.month < data.SIM_MONTHS:
+        month = model.month
+        model.step(profiler)
+        if data.CHECKPOINT_INTERVAL and model.month % data.CHECKPOINT_INTERVAL == 0:
+            save_checkpoint(data.CHECKPOINT_FILE.format(run=run), model, job)
+        if store is not None:
+            store.write_completed(data, model.month)
+        summary, before = month_summary(data, month, before)
+        yield summary
+
+
+def run_model(model, job, stop=None):
+    # stop(data, summary), when given, is called after every month and ends
+    # the run early by returning True; the month it stopped at is reported
+    data = model.data
+    run = job["run"]
+
+    profiler = make_profiler(data, run, model.month)
+    t = Timer()
+    t.start()
+    stopped = None
+    for summary in simulate(model, job, profiler):
+        if stop is not None and stop(data, summary):
+            stopped = summary["month"]
+            break
+    elapsed = t.stop()
+    profiler.close()
+    if stopped is not None and hasattr(model, "close"):
+        model.close()
+
+    model.archive.close()
+    data.write_infections(run)
+    if data.network is not None:
+        data.network.write(run, data.SEXUAL_DEBUT_AGE)
+
+    result = {
+        "run": run,
+        "section": job["section"],
+        "replicate": job["replicate"],
+        "entropy": data.rng.seed.entropy,
+        "incident": int(np.sum(data.incidentinfections)),
+        "uninfected": int(np.sum(data.noinfection)),
+        "prevalent": int(np.sum(data.prevalentinfections)),
+        "alive": int(np.sum(data.totalalive)),
+        "seconds": round(elapsed, 4),
+        "cached": False}
+    if stop is not None:
+        result["stopped"] = stopped
+    return result
+
+
+def write_summary(filename, results):
+    fields = ["run", "section", "replicate", "entropy", "incident", "uninfected", "prevalent", "alive", "seconds",
+              "cached"]
+    with open(filename, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(results)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,133 @@
+import numpy as np
+
+# last bin of the degree histogram, which also holds everyone with more partners
+MAX_DEGREE = 4
+
+
+class NetworkStats:
+    """Running statistics of the partnership network of one run (NETWORK_STATS).
+
+    Updated as partnerships form and end and once a month for everyone alive,
+    so nothing about dissolved partnerships or the dead has to be retained.
+    Like the Data counters, arrays are indexed by sex (0 female, 1 male) first
+    where they have one and by year last; partnership types are indexed by
+    PartnershipType.value - 1.
+
+    degree     person-months by sex, age and number of current partnerships
+               (0 to MAX_DEGREE or more)
+    partners   partner-months by sex and age, the exact sum behind degree
+    formed     partnerships formed by sex, type and age of that partner
+    dissolved  partnerships ended, the same way
+    age_gap    partnerships formed by the woman's age and the man's age minus
+               hers, offset by max_gap (the oldest age)
+    durations  partnerships ended by type and months lasted, one bin per
+               month up to the length of the run
+
+    No partnership can outlast the run, so the durations histogram is an
+    exact quantile sketch whose size depends only on the number of months.
+    """
+    ARRAYS = ("degree", "partners", "formed", "dissolved", "age_gap", "durations")
+
+    def __init__(self, n_ages, years, type_names):
+        self.type_names = list(type_names)
+        n_types = len(self.type_names)
+        self.max_gap = n_ages - 1
+        self.degree = np.zeros((2, n_ages, MAX_DEGREE + 1, years), dtype=np.int64)
+        self.partners = np.zeros((2, n_ages, years), dtype=np.int64)
+        self.formed = np.zeros((2, n_types, n_ages, years), dtype=np.int64)
+        self.dissolved = np.zeros((2, n_types, n_ages, years), dtype=np.int64)
+        self.age_gap = np.zeros((n_ages, 2 * self.max_gap + 1, years), dtype=np.int64)
+        self.durations = np.zeros((n_types, 12 * years + 1, years), dtype=np.int64)
+
+    def extend(self, years):
+        # make room for a longer run, keeping the counts so far
+        for name in self.ARRAYS:
+            counts = getattr(self, name)
+            padding = [(0, 0)] * (counts.ndim - 1) + [(0, max(years - counts.shape[-1], 0))]
+            setattr(self, name, np.pad(counts, padding))
+        durations = self.durations
+        self.durations = np.pad(durations, [(0, 0), (0, max(12 * years + 1 - durations.shape[1], 0)), (0, 0)])
+
+    def count_degrees(self, year, female, ages, degrees, weights=None):
+        # this month's person-months by number of partnerships; female, degrees
+        # and weights may be scalars or arrays matching ages
+        ages = np.asarray(ages)
+        sex = np.broadcast_to(np.where(female, 0, 1), ages.shape)
+        degrees = np.broadcast_to(degrees, ages.shape)
+        counts = self.degree[..., year]
+        flat = np.ravel_multi_index((sex, ages, np.minimum(degrees, MAX_DEGREE)), counts.shape)
+        counts += np.bincount(flat.ravel(), weights, minlength=counts.size).astype(np.int64).reshape(counts.shape)
+        partners = self.partners[..., year]
+        flat = np.ravel_multi_index((sex, ages), partners.shape)
+        if weights is not None:
+            degrees = degrees * weights
+        partners += np.bincount(flat.ravel(), degrees, minlength=partners.size).astype(np.int64).reshape(partners.shape)
+
+    def add_partnership(self, year, female_age, male_age, ptype):
+        # one partnership formed, of PartnershipType.value ptype
+        self.formed[0, ptype - 1, female_age, year] += 1
+        self.formed[1, ptype - 1, male_age, year] += 1
+        self.age_gap[female_age, male_age - female_age + self.max_gap, year] += 1
+
+    def end_partnership(self, year, female_age, male_age, ptype, duration):
+        self.dissolved[0, ptype - 1, female_age, year] += 1
+        self.dissolved[1, ptype - 1, male_age, year] += 1
+        self.durations[ptype - 1, duration, year] += 1
+
+    def add_partnerships(self, year, female_ages, male_ages, ptypes):
+        # add_partnership for arrays of partnerships
+        types = np.asarray(ptypes, dtype=np.intp) - 1
+        np.add.at(self.formed[..., year], (0, types, female_ages), 1)
+        np.add.at(self.formed[..., year], (1, types, male_ages), 1)
+        gap = np.asarray(male_ages, dtype=np.intp) - female_ages
+        np.add.at(self.age_gap[..., year], (female_ages, gap + self.max_gap), 1)
+
+    def end_partnerships(self, year, female_ages, male_ages, ptypes, durations):
+        types = np.asarray(ptypes, dtype=np.intp) - 1
+        np.add.at(self.dissolved[..., year], (0, types, female_ages), 1)
+        np.add.at(self.dissolved[..., year], (1, types, male_ages), 1)
+        np.add.at(self.durations[..., year], (types, durations), 1)
+
+    def summary(self, first_age=0):
+        """One row per year: person-months, mean number of partners and the
+        share of people with a partner who have more than one, by sex, for
+        ages from first_age; partnerships formed (in all and by type) and
+        ended; median age gap; median and 90th percentile duration.
+        """
+        rows = []
+        for year in range(self.degree.shape[-1]):
+            row = {"year": year}
+            for sex, name in enumerate(("female", "male")):
+                degree = self.degree[sex, first_age:, :, year].sum(axis=0)
+                months = degree.sum()
+                row["person_months_" + name] = int(months)
+                partners = self.partners[sex, first_age:, year].sum()
+                row["mean_partners_" + name] = partners / months if months else np.nan
+                row["concurrency_" + name] = degree[2:].sum() / degree[1:].sum() if degree[1:].any() else np.nan
+            formed = self.formed[0, ..., year].sum(axis=1)
+            row["formed"] = int(formed.sum())
+            row.update(("formed_" + name, int(n)) for name, n in zip(self.type_names, formed))
+            row["dissolved"] = int(self.dissolved[0, ..., year].sum())
+            row["median_age_gap"] = histogram_quantile(self.age_gap[..., year].sum(axis=0), 0.5) - self.max_gap
+            durations = self.durations[..., year].sum(axis=0)
+            row["median_duration"] = histogram_quantile(durations, 0.5)
+            row["p90_duration"] = histogram_quantile(durations, 0.9)
+            rows.append(row)
+        return rows
+
+    def write(self, run, first_age=0):
+        # network_<run>.npz with every array and network_<run>.csv with summary()
+        np.savez_compressed("network_" + run + ".npz", type_names=np.array(self.type_names),
+                            **{name: getattr(self, name) for name in self.ARRAYS})
+        rows = self.summary(first_age)
+        fields = list(rows[0]) if rows else ["year"]
+        table = np.array([[row[field] for field in fields] for row in rows], dtype=float).reshape(-1, len(fields))
+        np.savetxt("network_" + run + ".csv", table, delimiter=",", header=",".join(fields), comments="", fmt="%.6g")
+
+
+def histogram_quantile(counts, q):
+    # the bin where the q quantile of a histogram falls, or nan if it is empty
+    total = counts.sum()
+    if not total:
+        return np.nan
+    return int(np.searchsorted(np.cumsum(counts), q * total))
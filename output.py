@@ -0,0 +1,66 @@
+import os
+import glob
+import numpy as np
+
+# sex or hpv value of rows that are summed over it
+ALL = -1
+COUNTS = ["alive", "uninfected", "prevalent", "incident"]
+RECORD = np.dtype([("year", np.int16), ("age", np.int16), ("sex", np.int8), ("hpv", np.int8)]
+                  + [(name, np.int64) for name in COUNTS])
+
+
+class ResultStore:
+    """Yearly counts of one run, streamed to RESULTS_DIR/<run>/year_<year>.npy.
+
+    Each chunk is an array of RECORD rows keyed by year, age, sex (0 female,
+    1 male) and HPV type (HPVType.value), with ALL in the rows that sum over
+    sex or type. Counts are person-months alive, uninfected and prevalent and
+    new infections, as in the incidence/prevalence files. Chunks are renamed
+    into place once written, so load_results() can read a run still going.
+    """
+
+    def __init__(self, directory, run):
+        self.directory = os.path.join(directory, run)
+        os.makedirs(self.directory, exist_ok=True)
+        self.years = 0
+
+    def write_year(self, year, records):
+        filename = os.path.join(self.directory, "year_%04d.npy" % year)
+        temporary = filename + ".tmp"
+        with open(temporary, "wb") as f:
+            np.save(f, records)
+        os.replace(temporary, filename)
+
+    def write_completed(self, data, month):
+        # every year finished by month that has not been written yet
+        while self.years < month // 12:
+            self.write_year(self.years, data.year_records(self.years))
+            self.years += 1
+
+
+def load_results(directory, run, years=None):
+    # the RECORD rows of run written so far, optionally only for some years
+    chunks = sorted(glob.glob(os.path.join(directory, run, "year_*.npy")))
+    if years is not None:
+        chunks = [c for c in chunks if int(os.path.basename(c)[5:9]) in set(years)]
+    if not chunks:
+        return np.zeros(0, dtype=RECORD)
+    return np.concatenate([np.load(c, mmap_mode="r") for c in chunks])
+
+
+def totals(data, year):
+    # counts so far in year, summed over age
+    return {"alive": int(data.alive_counts[..., year].sum()),
+            "uninfected": int(data.uninfected_counts[..., year].sum()),
+            "prevalent": int(data.prevalent_counts[..., year].sum()),
+            "incident": int(data.incident_counts[..., year].sum())}
+
+
+def month_summary(data, month, before):
+    # the counts of one month, from the year's totals before and after it
+    year = month // 12
+    after = totals(data, year)
+    summary = {"month": month, "year": year}
+    summary.update({name: after[name] - (before[name] if month % 12 else 0) for name in COUNTS})
+    summary["prevalence"] = summary["prevalent"] / summary["alive"] if summary["alive"] else float("nan")
+    return summary, after
@@ -0,0 +1,106 @@
+import os
+import json
+import time
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+PHASES = ["female", "male", "relationships", "cleanup", "aging"]
+COUNTERS = ["formed", "dissolved", "transmissions", "population", "rss"]
+
+
+def current_rss():
+    # resident set size in bytes; peak RSS where /proc is not available
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        if resource is None:
+            return 0
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class NullProfiler:
+    """Stands in for PhaseProfiler when PROFILE is off; every call is a no-op"""
+
+    def start(self):
+        pass
+
+    def lap(self, phase):
+        pass
+
+    def count(self, **counters):
+        pass
+
+    def end_month(self, month):
+        pass
+
+    def close(self):
+        pass
+
+
+class PhaseProfiler:
+    """Writes per-month phase timings and counters to a JSON lines or CSV file.
+
+    The model calls start() at the top of a month, lap(phase) at the end of each
+    phase in PHASES, count() with any of COUNTERS, and end_month() to emit the
+    record. A run resumed from a checkpoint at first_month appends to the
+    file, after dropping any records from first_month on written by the
+    run that was interrupted.
+    """
+
+    def __init__(self, filename, first_month=0):
+        self.csv = filename.endswith(".csv")
+        if first_month and os.path.exists(filename):
+            keep_records(filename, self.csv, first_month)
+            self.file = open(filename, "a")
+        else:
+            self.file = open(filename, "w")
+            if self.csv:
+                self.file.write(",".join(["month"] + PHASES + COUNTERS) + "\n")
+        self.record = dict()
+        self._last = None
+
+    def start(self):
+        self.record = dict()
+        self._last = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.record[phase] = self.record.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def count(self, **counters):
+        for name, value in counters.items():
+            self.record[name] = self.record.get(name, 0) + value
+
+    def end_month(self, month):
+        record = {"month": month}
+        record.update({phase: round(self.record.get(phase, 0.0), 6) for phase in PHASES})
+        record.update({name: self.record.get(name, 0) for name in COUNTERS[:-1]})
+        record["rss"] = current_rss()
+        if self.csv:
+            self.file.write(",".join(str(record[k]) for k in ["month"] + PHASES + COUNTERS) + "\n")
+        else:
+            self.file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+def keep_records(filename, csv, first_month):
+    # rewrite filename with only the records of months before first_month
+    with open(filename) as f:
+        lines = f.readlines()
+    header, records = (lines[:1], lines[1:]) if csv else ([], lines)
+    month = (lambda line: int(line.split(",")[0])) if csv else (lambda line: json.loads(line)["month"])
+    with open(filename, "w") as f:
+        f.writelines(header + [line for line in records if line.strip() and month(line) < first_month])
+
+
+def make_profiler(data, run, first_month=0):
+    if not data.PROFILE:
+        return NullProfiler()
+    return PhaseProfiler(data.PROFILE_FILE.format(run=run), first_month)
+
@@ -0,0 +1,51 @@
+import numpy as np
+
+DEFAULT_BLOCK_SIZE = 4096
+STREAMS = ("demography", "partnering", "transmission")
+
+
+class RandomStream:
+    """One numpy Generator that hands out scalar variates from pre-generated blocks.
+
+    Vector draws go straight to .generator; scalar uniforms and Poisson variates
+    are popped off blocks of block_size values drawn in a single call.
+    """
+
+    def __init__(self, seed, block_size=DEFAULT_BLOCK_SIZE):
+        self.generator = np.random.default_rng(seed)
+        self.block_size = block_size
+        self._uniforms = []
+        self._poisson = dict()
+
+    def random(self):
+        if not self._uniforms:
+            self._uniforms = self.generator.random(self.block_size).tolist()
+        return self._uniforms.pop()
+
+    def randrange(self, start, stop):
+        return start + int(self.random() * (stop - start))
+
+    def poisson(self, lam):
+        block = self._poisson.get(lam)
+        if not block:
+            block = self._poisson[lam] = self.generator.poisson(lam, self.block_size).tolist()
+        return block.pop()
+
+    def uniforms(self, size):
+        return self.generator.random(size)
+
+
+class RandomStreams:
+    """Independent demography, partnering and transmission streams for one run.
+
+    The streams are derived from the run seed by name position, so two scenarios
+    run with the same seed draw common random numbers for each process.
+    """
+
+    def __init__(self, seed=None, block_size=DEFAULT_BLOCK_SIZE):
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed = seed
+        self.demography, self.partnering, self.transmission = [
+            RandomStream(np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (k,)), block_size)
+            for k in range(len(STREAMS))]
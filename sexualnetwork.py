@@ -1,13 +1,30 @@
-import uuid
+import os
+import math
+import heapq
+from bisect import bisect_right
+from collections import defaultdict
+from itertools import count
 from enum import Enum
-import random
 import time
 import numpy as np
-import pandas as pd
+from rng import RandomStreams, DEFAULT_BLOCK_SIZE
+from output import RECORD, ALL
+from tables import read_table, as_frame, DEFAULT_TABLE_CACHE
+from cache import DEFAULT_RESULT_CACHE
+from network import NetworkStats
 
 np.seterr(divide='ignore', invalid='ignore')
 
 
+# partner ages are drawn from 0 to MAX_PARTNER_AGE
+MAX_PARTNER_AGE = 75
+# ini options naming the input CSVs
+TABLE_FILES = ["BACKGROUND_MORTALITY_FEMALE_FILE", "BACKGROUND_MORTALITY_MALE_FILE", "AGE_OF_PARTNER_FILE",
+               "PARTNERSHIP_FORMATION_FILE", "INITIAL_POPULATION_FILE", "HPV_CLEARANCE_FILE"]
+# the Data arrays holding a run's counts
+COUNT_ARRAYS = ("alive_counts", "uninfected_counts", "prevalent_counts", "type_prevalent_counts", "incident_counts")
+
+
 class Gender(Enum):
     MALE = 1
     FEMALE = 2
@@ -19,10 +36,52 @@ class HPVType(Enum):
     HPVoHR = 2
     HPVLR = 3
 
+    @property
+    def mask(self):
+        return 1 << self.value
+
 
 class Data:
 
     def __init__(self, section):
+        self.load(section)
+        self.transmissions_attempted = 0
+        # CLEARANCE = sampled: (person id, infection id) pairs keyed by the
+        # month they clear, and the first month whose clearance checks are
+        # still to come; ids rather than people, so the dead are not kept
+        self.clearances = EventQueue()
+        self.next_clearance_month = 0
+        # person-months and new infections by sex (0 female, 1 male), HPV
+        # type, age and year
+        n_ages = self.N_AGES
+        self.alive_counts = np.zeros((2, n_ages, self.SIM_YEARS), dtype=np.int64)
+        self.uninfected_counts = np.zeros((2, n_ages, self.SIM_YEARS), dtype=np.int64)
+        self.prevalent_counts = np.zeros((2, n_ages, self.SIM_YEARS), dtype=np.int64)
+        self.type_prevalent_counts = np.zeros((2, len(HPVType), n_ages, self.SIM_YEARS), dtype=np.int64)
+        self.incident_counts = np.zeros((2, len(HPVType), n_ages, self.SIM_YEARS), dtype=np.int64)
+        self.network = self.network_stats() if self.NETWORK_STATS else None
+
+    def update(self, section):
+        # switch to another section's parameters mid-run (e.g. when branching
+        # from a checkpoint), keeping the counts so far and extending them to
+        # the new SIM_YEARS
+        self.load(section)
+        for name in COUNT_ARRAYS:
+            counts = getattr(self, name)
+            padding = [(0, 0)] * (counts.ndim - 1) + [(0, max(self.SIM_YEARS - counts.shape[-1], 0))]
+            setattr(self, name, np.pad(counts, padding))
+        if not self.NETWORK_STATS:
+            self.network = None
+        elif getattr(self, "network", None) is None:
+            self.network = self.network_stats()
+        else:
+            self.network.extend(self.SIM_YEARS)
+
+    def network_stats(self):
+        types = sorted(PartnershipType, key=lambda t: t.value)
+        return NetworkStats(self.N_AGES, self.SIM_YEARS, [t.name.lower() for t in types])
+
+    def load(self, section):
         self.COHORT_SIZE: int = int(section["COHORT_SIZE"])
         self.SIM_YEARS: int = int(section["SIM_YEARS"])
         self.SIM_MONTHS = self.SIM_YEARS * 12
@@ -45,28 +104,176 @@ class Data:
         self.NATURAL_IMMUNITY_HPV18: float = float(section["NATURAL_IMMUNITY_HPV18"])
         self.NATURAL_IMMUNITY_HPVoHR: float = float(section["NATURAL_IMMUNITY_HPVoHR"])
         self.NATURAL_IMMUNITY_HPVLR: float = float(section["NATURAL_IMMUNITY_HPVLR"])
-        self.BACKGROUND_MORTALITY_FEMALE = pd.read_csv(section["BACKGROUND_MORTALITY_FEMALE_FILE"])
-        self.BACKGROUND_MORTALITY_MALE = pd.read_csv(section["BACKGROUND_MORTALITY_MALE_FILE"])
-        self.AGE_OF_PARTNER = pd.read_csv(section["AGE_OF_PARTNER_FILE"])
-        self.PARTNERSHIP_FORMATION = pd.read_csv(section["PARTNERSHIP_FORMATION_FILE"])
-        self.INITIAL_POPULATION = pd.read_csv(section["INITIAL_POPULATION_FILE"])
-        self.HPV_CLEARANCE = pd.read_csv(section["HPV_CLEARANCE_FILE"])
-        self.incidentinfections = [[0] * self.SIM_YEARS for _ in range(self.INITIAL_POPULATION.shape[0])]
-        self.prevalentinfections = [[0] * self.SIM_YEARS for _ in range(self.INITIAL_POPULATION.shape[0])]
-        self.noinfection = [[0] * self.SIM_YEARS for _ in range(self.INITIAL_POPULATION.shape[0])]
-        self.totalalive = [[0] * self.SIM_YEARS for _ in range(self.INITIAL_POPULATION.shape[0])]
-
-    def count_incident_infections(self, infection):
-        self.incidentinfections[infection.InfectionAge][Individual.year] += 1
-
-    def count_infection_denom(self, age):
-        self.noinfection[age][Individual.year] += 1
-
-    def count_prevalent_infections(self, age):
-        self.prevalentinfections[age][Individual.year] += 1
-
-    def count_total_alive(self, age):
-        self.totalalive[age][Individual.year] += 1
+        self.ENGINE: str = option_choice(section, "ENGINE", ("agent", "array", "sharded"))
+        self.SHARDS: int = shard_count(section.get("SHARDS", "0"))
+        self.REPLICATES: int = int(section.get("REPLICATES", "1"))
+        self.SEED = None if section.get("SEED") is None else int(section["SEED"])
+        self.RNG_BLOCK_SIZE: int = int(section.get("RNG_BLOCK_SIZE", str(DEFAULT_BLOCK_SIZE)))
+        self.rng = RandomStreams(self.SEED, self.RNG_BLOCK_SIZE)
+        self.RETENTION: str = section.get("RETENTION", "keep")
+        self.RETENTION_BUFFER: int = int(section.get("RETENTION_BUFFER", "10000"))
+        self.CHECKPOINT_INTERVAL: int = int(section.get("CHECKPOINT_INTERVAL", "0"))
+        self.CHECKPOINT_FILE: str = section.get("CHECKPOINT_FILE", "checkpoint_{run}.pkl.gz")
+        self.CLEARANCE: str = option_choice(section, "CLEARANCE", ("monthly", "sampled"))
+        # agent model: keep children and the old without partners as counts
+        self.HYBRID: bool = section.getboolean("HYBRID", fallback=False)
+        self.RESULTS_DIR: str = section.get("RESULTS_DIR", "")
+        self.PROFILE: bool = section.getboolean("PROFILE", fallback=False)
+        self.PROFILE_FILE: str = section.get("PROFILE_FILE", "profile_{run}.jsonl")
+        # collect network statistics (network.py) as the run goes
+        self.NETWORK_STATS: bool = section.getboolean("NETWORK_STATS", fallback=False)
+        self.TABLE_CACHE: str = section.get("TABLE_CACHE", DEFAULT_TABLE_CACHE)
+        self.RESULT_CACHE: str = section.get("RESULT_CACHE", DEFAULT_RESULT_CACHE)
+        self.RESULT_CACHE_MB: float = float(section.get("RESULT_CACHE_MB", "1024"))
+        # the input tables as read-only structured arrays, memory-mapped from
+        # TABLE_CACHE, keyed by their *_FILE option
+        self.tables = {key: read_table(section[key], self.TABLE_CACHE) for key in TABLE_FILES}
+        # plain arrays indexed by age (or by Timer for clearance) for the hot loop
+        self.N_AGES = len(self.tables["INITIAL_POPULATION_FILE"])
+        self.MORTALITY_FEMALE = self.tables["BACKGROUND_MORTALITY_FEMALE_FILE"]["mASR"]
+        self.MORTALITY_MALE = self.tables["BACKGROUND_MORTALITY_MALE_FILE"]["mASR"]
+        self.PARTNER_AGE_MEAN = self.tables["AGE_OF_PARTNER_FILE"]["mean"]
+        partner_age = self.tables["AGE_OF_PARTNER_FILE"]
+        self.PARTNER_AGE_SD = partner_age["SD"] if "SD" in partner_age.dtype.names else None
+        self.PARTNER_AGE_MODEL: str = section.get("PARTNER_AGE_MODEL", "poisson")
+        # cumulative distribution of partner age 0..MAX_PARTNER_AGE by female
+        # age, as an array for batched draws and as lists for scalar ones
+        self.PARTNER_AGE_CDF = partner_age_cdf(self.PARTNER_AGE_MEAN, self.PARTNER_AGE_SD, self.PARTNER_AGE_MODEL)
+        self.PARTNER_AGE_CDF_ROWS = tuple(self.PARTNER_AGE_CDF.tolist())
+        self.FORMATION_FEMALE = self.tables["PARTNERSHIP_FORMATION_FILE"]["Female"]
+        self.FORMATION_MALE = self.tables["PARTNERSHIP_FORMATION_FILE"]["Male"]
+        # monthly clearance hazard by Timer and HPVType.value, and as one tuple
+        # per type for the scalar lookups of the agent model
+        self.CLEARANCE_HAZARD = np.column_stack([self.tables["HPV_CLEARANCE_FILE"][t.name] for t in HPVType])
+        self.CLEARANCE_HAZARD_BY_TYPE = tuple(tuple(column) for column in self.CLEARANCE_HAZARD.T.tolist())
+        # chance of having survived each monthly check (Timer = 1, 2, ...) by
+        # type; the last row's hazard carries on past the end of the table
+        self.CLEARANCE_SURVIVAL = np.cumprod(1 - self.CLEARANCE_HAZARD[1:], axis=0)
+        self.CLEARANCE_TAIL = self.CLEARANCE_HAZARD[-1]
+
+    # the input tables as pandas DataFrames, for interactive use; the model
+    # itself only uses the arrays above, so pandas is imported on first use
+
+    @property
+    def BACKGROUND_MORTALITY_FEMALE(self):
+        return as_frame(self.tables["BACKGROUND_MORTALITY_FEMALE_FILE"])
+
+    @property
+    def BACKGROUND_MORTALITY_MALE(self):
+        return as_frame(self.tables["BACKGROUND_MORTALITY_MALE_FILE"])
+
+    @property
+    def AGE_OF_PARTNER(self):
+        return as_frame(self.tables["AGE_OF_PARTNER_FILE"])
+
+    @property
+    def PARTNERSHIP_FORMATION(self):
+        return as_frame(self.tables["PARTNERSHIP_FORMATION_FILE"])
+
+    @property
+    def INITIAL_POPULATION(self):
+        return as_frame(self.tables["INITIAL_POPULATION_FILE"])
+
+    @property
+    def HPV_CLEARANCE(self):
+        return as_frame(self.tables["HPV_CLEARANCE_FILE"])
+
+    def initial_numbers(self):
+        # women and men of each age at the start of the run
+        fractions = self.tables["INITIAL_POPULATION_FILE"]
+        return ((fractions["FEMALE"] * self.COHORT_SIZE).astype(int),
+                (fractions["MALE"] * self.COHORT_SIZE).astype(int))
+
+    def clearance_checks(self, hpv, u):
+        # CLEARANCE = sampled: the number of monthly checks an infection of
+        # type hpv survives before the one that clears it, from uniforms u;
+        # the same distribution as a Bernoulli draw per check
+        survival = self.CLEARANCE_SURVIVAL[:, hpv]
+        checks = np.searchsorted(-survival, -np.asarray(u), side="left")
+        tail = checks == len(survival)
+        if np.any(tail):
+            if self.CLEARANCE_TAIL[hpv] > 0:
+                extra = self.rng.transmission.generator.geometric(self.CLEARANCE_TAIL[hpv], np.shape(checks))
+            else:
+                extra = np.iinfo(np.int32).max // 2
+            checks = np.where(tail, len(survival) - 1 + extra, checks)
+        return checks
+
+    def count_survivors(self, year, female, ages, masks, weights=None):
+        # person-months of everyone who survived this month's mortality draw:
+        # female (one flag or one per person), ages and HPVType.mask bitmasks
+        # of their current infections, each row standing for weights people
+        n_ages = self.alive_counts.shape[1]
+        key = np.where(female, 0, n_ages) + ages
+        weights = np.ones(len(key), dtype=np.int64) if weights is None else np.asarray(weights)
+
+        def tally(rows):
+            return np.bincount(key[rows], weights[rows], minlength=2 * n_ages).astype(np.int64).reshape(2, n_ages)
+
+        alive = tally(slice(None))
+        prevalent = tally(masks != 0)
+        self.alive_counts[:, :, year] += alive
+        self.prevalent_counts[:, :, year] += prevalent
+        self.uninfected_counts[:, :, year] += alive - prevalent
+        for hpv in HPVType:
+            self.type_prevalent_counts[:, hpv.value, :, year] += tally((masks & hpv.mask) != 0)
+
+    def count_incidence(self, year, female, hpv, ages):
+        # new infections of one type, for one person or arrays of people
+        if np.ndim(ages) == 0:
+            self.incident_counts[0 if female else 1, hpv, ages, year] += 1
+        else:
+            n_ages = self.incident_counts.shape[2]
+            key = np.where(female, 0, n_ages) + ages
+            self.incident_counts[:, hpv, :, year] += np.bincount(key, minlength=2 * n_ages).reshape(2, n_ages)
+
+    # the original age x year tables, summed over sex and type
+
+    @property
+    def totalalive(self):
+        return self.alive_counts.sum(axis=0)
+
+    @property
+    def noinfection(self):
+        return self.uninfected_counts.sum(axis=0)
+
+    @property
+    def prevalentinfections(self):
+        return self.prevalent_counts.sum(axis=0)
+
+    @property
+    def incidentinfections(self):
+        return self.incident_counts.sum(axis=(0, 1))
+
+    def year_records(self, year):
+        # output.RECORD rows of one year: every age for each sex and HPV type
+        # and for their totals (ALL); uninfected in a type's rows means not
+        # infected with that type
+        n_ages = self.alive_counts.shape[1]
+        alive = self.alive_counts[:, :, year]
+        tables = []
+        for sex in (0, 1, ALL):
+            for hpv in [t.value for t in HPVType] + [ALL]:
+                pick = slice(None) if sex == ALL else slice(sex, sex + 1)
+                if hpv == ALL:
+                    prevalent = self.prevalent_counts[pick, :, year].sum(axis=0)
+                    uninfected = self.uninfected_counts[pick, :, year].sum(axis=0)
+                    incident = self.incident_counts[pick, :, :, year].sum(axis=(0, 1))
+                else:
+                    prevalent = self.type_prevalent_counts[pick, hpv, :, year].sum(axis=0)
+                    uninfected = alive[pick].sum(axis=0) - prevalent
+                    incident = self.incident_counts[pick, hpv, :, year].sum(axis=0)
+                records = np.zeros(n_ages, dtype=RECORD)
+                records["year"] = year
+                records["age"] = np.arange(n_ages)
+                records["sex"] = sex
+                records["hpv"] = hpv
+                records["alive"] = alive[pick].sum(axis=0)
+                records["uninfected"] = uninfected
+                records["prevalent"] = prevalent
+                records["incident"] = incident
+                tables.append(records)
+        return np.concatenate(tables)
 
     def write_infections(self, run):
         incidence = np.divide(self.incidentinfections, self.noinfection)
@@ -75,123 +282,178 @@ class Data:
         np.savetxt('prevalence_' + run + '.csv', prevalence, fmt='%f')
 
 
+def transmission_probability(per_act, sexacts):
+    # chance that at least one of sexacts independent acts transmits;
+    # works elementwise on arrays of probabilities and act counts
+    return 1 - (1 - per_act) ** sexacts
+
+
 class Infection:
+    __slots__ = ("Timer", "InfectionAge", "HPVClearance", "HPVTransmission", "NaturalImmunity", "ClearanceMonth")
+    Type = None
+    Mask = 0
 
     def __init__(self):
-        self.Type = None
         self.Timer = 1
+        # with CLEARANCE = sampled, the month the infection clears
+        self.ClearanceMonth = None
         self.HPVTransmission = None
         self.NaturalImmunity = None
 
     def get_clearance(self):
         return -1
 
-    def check_serodiscordance(self, person, sexacts):
-        discordant = True
-        infection_keys = [key for key, value in person.Infections.items() if value.Type == self.Type]
-        if len(infection_keys) > 0:
-            discordant = False
+    def refresh_parameters(self, data):
+        self.HPVClearance = data.CLEARANCE_HAZARD_BY_TYPE[self.Type.value]
+        self.HPVTransmission = data.TRANSMISSION_PER_SEX_ACT
+        self.NaturalImmunity = getattr(data, "NATURAL_IMMUNITY_" + self.Type.name)
 
-        if discordant:
+    def check_serodiscordance(self, person, sexacts):
+        if not person.infection_mask & self.Mask:
             self.transmit_infection(person, sexacts)
 
     def transmit_infection(self, person, sexacts):
-        pass
+        # one draw for the whole month instead of one per sex act
+        person.data.transmissions_attempted += 1
+        rand = person.data.rng.transmission.random()
+        if rand < transmission_probability(self.get_hpv_transmission(person), sexacts):
+            person.acquire_infection(type(self))
 
     def get_hpv_transmission(self, person):
-        infection_keys = [key for key, value in person.ClearedInfections.items() if value.Type == self.Type]
-        if len(infection_keys) > 0:
-            history = True
-        else:
-            history = False
-        if history:
+        if person.cleared_mask & self.Mask:
             return self.HPVTransmission * self.NaturalImmunity
         else:
             return self.HPVTransmission
 
 
 class HPV16Infection(Infection):
+    __slots__ = ()
+    Type = HPVType.HPV16
+    Mask = HPVType.HPV16.mask
 
     def __init__(self, data, age):
         super(HPV16Infection, self).__init__()
-        self.Type = HPVType.HPV16
-        self.HPVClearance = data.HPV_CLEARANCE["HPV16"]
+        self.HPVClearance = data.CLEARANCE_HAZARD_BY_TYPE[HPVType.HPV16.value]
         self.HPVTransmission = data.TRANSMISSION_PER_SEX_ACT
         self.InfectionAge = age
         self.NaturalImmunity = data.NATURAL_IMMUNITY_HPV16
 
     def get_clearance(self):
-        return self.HPVClearance.iloc[self.Timer]
-
-    def transmit_infection(self, person, sexacts):
-        for _ in range(sexacts):
-            rand = random.random()
-            if rand < self.get_hpv_transmission(person):
-                person.acquire_infection(HPV16Infection)
-                break
+        return self.HPVClearance[min(self.Timer, len(self.HPVClearance) - 1)]
 
 
 class HPV18Infection(Infection):
+    __slots__ = ()
+    Type = HPVType.HPV18
+    Mask = HPVType.HPV18.mask
 
     def __init__(self, data, age):
         super(HPV18Infection, self).__init__()
-        self.Type = HPVType.HPV18
-        self.HPVClearance = data.HPV_CLEARANCE["HPV18"]
+        self.HPVClearance = data.CLEARANCE_HAZARD_BY_TYPE[HPVType.HPV18.value]
         self.HPVTransmission = data.TRANSMISSION_PER_SEX_ACT
         self.InfectionAge = age
         self.NaturalImmunity = data.NATURAL_IMMUNITY_HPV18
 
     def get_clearance(self):
-        return self.HPVClearance.iloc[self.Timer]
-
-    def transmit_infection(self, person, sexacts):
-        for _ in range(sexacts):
-            rand = random.random()
-            if rand < self.get_hpv_transmission(person):
-                person.acquire_infection(HPV18Infection)
-                break
+        return self.HPVClearance[min(self.Timer, len(self.HPVClearance) - 1)]
 
 
 class HPVoHRInfection(Infection):
+    __slots__ = ()
+    Type = HPVType.HPVoHR
+    Mask = HPVType.HPVoHR.mask
 
     def __init__(self, data, age):
         super(HPVoHRInfection, self).__init__()
-        self.Type = HPVType.HPVoHR
-        self.HPVClearance = data.HPV_CLEARANCE["HPVoHR"]
+        self.HPVClearance = data.CLEARANCE_HAZARD_BY_TYPE[HPVType.HPVoHR.value]
         self.HPVTransmission = data.TRANSMISSION_PER_SEX_ACT
         self.InfectionAge = age
         self.NaturalImmunity = data.NATURAL_IMMUNITY_HPVoHR
 
     def get_clearance(self):
-        return self.HPVClearance.iloc[self.Timer]
-
-    def transmit_infection(self, person, sexacts):
-        for _ in range(sexacts):
-            rand = random.random()
-            if rand < self.get_hpv_transmission(person):
-                person.acquire_infection(HPVoHRInfection)
-                break
+        return self.HPVClearance[min(self.Timer, len(self.HPVClearance) - 1)]
 
 
 class HPVLRInfection(Infection):
+    __slots__ = ()
+    Type = HPVType.HPVLR
+    Mask = HPVType.HPVLR.mask
 
     def __init__(self, data, age):
         super(HPVLRInfection, self).__init__()
-        self.Type = HPVType.HPVLR
-        self.HPVClearance = data.HPV_CLEARANCE["HPVLR"]
+        self.HPVClearance = data.CLEARANCE_HAZARD_BY_TYPE[HPVType.HPVLR.value]
         self.HPVTransmission = data.TRANSMISSION_PER_SEX_ACT
         self.InfectionAge = age
         self.NaturalImmunity = data.NATURAL_IMMUNITY_HPVLR
 
     def get_clearance(self):
-        return self.HPVClearance.iloc[self.Timer]
-
-    def transmit_infection(self, person, sexacts):
-        for _ in range(sexacts):
-            rand = random.random()
-            if rand < self.get_hpv_transmission(person):
-                person.acquire_infection(HPVLRInfection)
-                break
+        return self.HPVClearance[min(self.Timer, len(self.HPVClearance) - 1)]
+
+
+INFECTION_CLASSES = {HPVType.HPV16: HPV16Infection, HPVType.HPV18: HPV18Infection,
+                     HPVType.HPVoHR: HPVoHRInfection, HPVType.HPVLR: HPVLRInfection}
+# initial HPV seeding at ages 17 < age < 30: the chance of each type, in the
+# order seed_infection() tests them
+SEED_AGES = slice(18, 30)
+SEED_TYPES = [HPVType.HPVoHR, HPVType.HPV16, HPVType.HPV18, HPVType.HPVLR]
+SEED_PROBABILITIES = [0.05, 0.10, 0.07, 0.08]
+
+
+def seed_counts(numbers, generator):
+    # how many of each age start with each of SEED_TYPES: one multinomial
+    # draw per age, with a last category for the uninfected
+    counts = np.zeros((len(numbers), len(SEED_TYPES)), dtype=np.int64)
+    pvals = SEED_PROBABILITIES + [1 - sum(SEED_PROBABILITIES)]
+    counts[SEED_AGES] = generator.multinomial(numbers[SEED_AGES], pvals)[:, :-1]
+    return counts
+
+
+def shard_count(value):
+    # worker processes of ENGINE = sharded for SHARDS = value; 0 means one per CPU
+    return int(value) or os.cpu_count() or 1
+
+
+def option_choice(section, name, choices):
+    # section's name option, which must be one of choices; the first is the default
+    value = section.get(name, choices[0])
+    if value not in choices:
+        raise ValueError("unknown %s %r, expected one of %s" % (name, value, ", ".join(choices)))
+    return value
+
+
+def partner_age_cdf(mean, sd=None, model="poisson"):
+    """The cumulative distribution of partner age by female age.
+
+    With model "poisson" each row is a Poisson with that age's mean truncated
+    at MAX_PARTNER_AGE, the distribution of redrawing until the age is in
+    range. With "normal" it is a normal with the mean and the SD column, rounded
+    to whole years and truncated to 0..MAX_PARTNER_AGE.
+    """
+    mean = np.asarray(mean, dtype=float)[:, None]
+    ages = np.arange(MAX_PARTNER_AGE + 1)
+    if model == "poisson":
+        log_factorial = np.concatenate([[0.0], np.cumsum(np.log(ages[1:]))])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_pmf = ages * np.log(mean) - mean - log_factorial
+        pmf = np.where(mean > 0, np.exp(np.nan_to_num(log_pmf, nan=-np.inf)), ages == 0)
+    elif model == "normal":
+        if sd is None:
+            raise ValueError("PARTNER_AGE_MODEL = normal needs an SD column in AGE_OF_PARTNER_FILE")
+        sd = np.asarray(sd, dtype=float)[:, None]
+        edges = np.append(ages - 0.5, MAX_PARTNER_AGE + 0.5)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = (edges - mean) / sd
+        z = np.where(sd > 0, z, np.where(edges > mean, np.inf, -np.inf))
+        pmf = np.diff(0.5 * (1 + np.vectorize(math.erf)(z / math.sqrt(2))), axis=1)
+        # rows with all their mass out of range put it on the nearest end
+        empty = pmf.sum(axis=1) == 0
+        pmf[empty, np.where(mean[empty, 0] > MAX_PARTNER_AGE, MAX_PARTNER_AGE, 0)] = 1
+    else:
+        raise ValueError("unknown PARTNER_AGE_MODEL %r" % model)
+    cdf = np.cumsum(pmf, axis=1)
+    cdf /= cdf[:, -1:]
+    cdf[:, -1] = 1.0
+    return cdf
 
 
 class PartnershipType(Enum):
@@ -202,6 +464,9 @@ class PartnershipType(Enum):
 
 
 class Partnership:
+    __slots__ = ("data", "partnership_id", "male", "male_id", "female", "female_id", "partnership_duration",
+                 "maxdur", "sexacts", "active", "start_month", "end_month")
+    partnership_type = None
 
     def __init__(
             self,
@@ -209,17 +474,24 @@ class Partnership:
             woman,
             man,
             data,
-            poisson_randomizer=lambda average: np.random.poisson(average, None)):
+            poisson_randomizer=None):
         self.data = data
+        if poisson_randomizer is None:
+            poisson_randomizer = data.rng.partnering.poisson
         self.partnership_id = partnershipid
         self.male = man
         self.male_id = man.id
         self.female = woman
         self.female_id = woman.id
+        # months it has lasted, including the current one; set when it dissolves
         self.partnership_duration = 1
         self.maxdur = 12 * poisson_randomizer(self.average_duration())
         self.sexacts = poisson_randomizer(self.sex_acts())
         self.active = True
+        # checked every month from start_month, it ends after maxdur checks
+        # (after the first if maxdur is 0) unless a partner dies first
+        self.start_month = Individual.month
+        self.end_month = Individual.month + max(self.maxdur - 1, 0)
 
     def average_duration(self):
         # Kinda expected that we'd never instantiate this class directly, but instead instantiate the subclasses
@@ -235,32 +507,22 @@ class Partnership:
         for _, inf in self.female.Infections.items():
             inf.check_serodiscordance(self.male, self.sexacts)
 
-    def check_relationships(self):
-        if self.female.alive and self.male.alive:
-            self.check_serodiscordance()
-            if self.partnership_duration < self.maxdur:
-                self.partnership_duration += 1
-            else:
-                self.dissolve_relationship()
-        else:
-            self.dissolve_relationship()
-
     def dissolve_relationship(self):
+        self.partnership_duration = Individual.month - self.start_month + 1
+        if self.data.network is not None:
+            self.data.network.end_partnership(Individual.year, self.female.age, self.male.age,
+                                              self.partnership_type.value, self.partnership_duration)
         self.female.numpartners -= 1
         self.female.partnershipid.remove(self.partnership_id)
+        self.female.partners.discard(self.male_id)
         self.male.partnershipid.remove(self.partnership_id)
         self.male.numpartners -= 1
         self.active = False
 
 
 class Marriage(Partnership):
-    def __init__(
-            self,
-            partnershipid,
-            woman,
-            man,
-            duration_randomizer=lambda average: np.random.poisson(average, None)):
-        super().__init__(partnershipid, woman, man, duration_randomizer)
+    __slots__ = ()
+    partnership_type = PartnershipType.MARITAL
 
     def average_duration(self):
         return self.data.DUR_MARITAL
@@ -270,13 +532,8 @@ class Marriage(Partnership):
 
 
 class CasualRelationship(Partnership):
-    def __init__(
-            self,
-            partnershipid,
-            woman,
-            man,
-            duration_randomizer=lambda average: np.random.poisson(average, None)):
-        super().__init__(partnershipid, woman, man, duration_randomizer)
+    __slots__ = ()
+    partnership_type = PartnershipType.CASUAL
 
     def average_duration(self):
         return self.data.DUR_CASUAL
@@ -286,13 +543,8 @@ class CasualRelationship(Partnership):
 
 
 class ShortTermRelationship(Partnership):
-    def __init__(
-            self,
-            partnershipid,
-            woman,
-            man,
-            duration_randomizer=lambda average: np.random.poisson(average, None)):
-        super().__init__(partnershipid, woman, man, duration_randomizer)
+    __slots__ = ()
+    partnership_type = PartnershipType.SHORT_TERM
 
     def average_duration(self):
         return self.data.DUR_SHORT_TERM
@@ -302,13 +554,8 @@ class ShortTermRelationship(Partnership):
 
 
 class InstantaneousRelationship(Partnership):
-    def __init__(
-            self,
-            partnershipid,
-            woman,
-            man,
-            duration_randomizer=lambda average: np.random.poisson(average, None)):
-        super().__init__(partnershipid, woman, man, duration_randomizer)
+    __slots__ = ()
+    partnership_type = PartnershipType.INSTANTANEOUS
 
     def average_duration(self):
         return 0
@@ -317,9 +564,100 @@ class InstantaneousRelationship(Partnership):
         return 1
 
 
+class EventQueue:
+    """Items keyed by the month they fall due.
+
+    Entries are (month, key, item) with a unique integer key, so items due in
+    the same month come out in key order and are never compared. Entries
+    that no longer apply are skipped by the caller instead of being removed.
+    """
+
+    def __init__(self):
+        self.heap = []
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, month, key, item):
+        heapq.heappush(self.heap, (month, key, item))
+
+    def pop_due(self, month):
+        # everything due in or before month
+        heap = self.heap
+        due = []
+        while heap and heap[0][0] <= month:
+            due.append(heapq.heappop(heap)[2])
+        return due
+
+
+class PartnerIndex:
+    """Living men grouped by age for partner selection.
+
+    Each age bucket is a list, and every man remembers his slot in it, so men
+    are added, removed and moved between ages in O(1) by swapping with the
+    last entry of the bucket.
+    """
+
+    def __init__(self):
+        self.buckets = defaultdict(list)
+        self.position = dict()
+
+    def __len__(self):
+        return len(self.position)
+
+    def add(self, man):
+        bucket = self.buckets[man.age]
+        self.position[man.id] = len(bucket)
+        bucket.append(man)
+
+    def remove(self, man, age=None):
+        bucket = self.buckets[man.age if age is None else age]
+        k = self.position.pop(man.id)
+        last = bucket.pop()
+        if last is not man:
+            bucket[k] = last
+            self.position[last.id] = k
+
+    def extend(self, men):
+        # bulk add, one bucket extend per age
+        by_age = defaultdict(list)
+        for man in men:
+            by_age[man.age].append(man)
+        for age, group in by_age.items():
+            bucket = self.buckets[age]
+            self.position.update((man.id, k) for k, man in enumerate(group, len(bucket)))
+            bucket.extend(group)
+
+    def move(self, man, old_age):
+        self.remove(man, old_age)
+        self.add(man)
+
+    def candidates(self, age, rng):
+        # the men of one age in random order, drawn lazily with an in-place
+        # Fisher-Yates shuffle so a search only pays for the men it looks at
+        bucket = self.buckets[age]
+        position = self.position
+        for i in range(len(bucket)):
+            j = rng.randrange(i, len(bucket))
+            if j != i:
+                bucket[i], bucket[j] = bucket[j], bucket[i]
+                position[bucket[i].id] = i
+                position[bucket[j].id] = j
+            yield bucket[i]
+
+
 class Individual:
+    """One person. Parameters shared by everyone of a sex live on data and
+    are looked up through the Woman/Man class rather than copied per person.
+    """
+    __slots__ = ("single", "numpartners", "partnershipid", "partners", "alive", "Infections",
+                 "ClearedInfections", "infection_mask", "cleared_mask", "age", "month_age", "id", "data")
+    # Gender of the subclass
+    gender = None
     month = 0
     year = 0
+    # source of person, partnership and infection ids
+    ids = count()
 
     def __init__(self,
                  age,
@@ -328,31 +666,42 @@ class Individual:
         self.single = True
         self.numpartners = 0
         self.partnershipid = []
+        self.partners = set()
         self.alive = True
         self.Infections = dict()
         self.ClearedInfections = dict()
+        # HPVType.mask bits of current and ever-cleared infections
+        self.infection_mask = 0
+        self.cleared_mask = 0
         self.age = age
         self.month_age = age * 12
         self.id = identifier
         self.data = data
-        self.ageofpartner = data.AGE_OF_PARTNER
-        self.sexualdebutage = data.SEXUAL_DEBUT_AGE
-        self.partnershipformation = data.PARTNERSHIP_FORMATION
 
     def acquire_infection(self, infectiontype):
-        infection_id = uuid.uuid1()
+        infection_id = next(Individual.ids)
         self.Infections[infection_id] = infectiontype(self.data, self.age)
-        self.data.count_incident_infections(self.Infections[infection_id])
+        self.infection_mask |= self.Infections[infection_id].Mask
+        self.data.count_incidence(Individual.year, self.gender is Gender.FEMALE, infectiontype.Type.value, self.age)
+        if self.data.CLEARANCE == "sampled":
+            data = self.data
+            checks = data.clearance_checks(infectiontype.Type.value, data.rng.transmission.random())
+            self.Infections[infection_id].ClearanceMonth = data.next_clearance_month + int(checks)
+            data.clearances.push(data.next_clearance_month + int(checks), infection_id, (self.id, infection_id))
 
     def clear_infection(self, infection_id):
-        self.ClearedInfections[infection_id] = self.Infections[infection_id]
-        del self.Infections[infection_id]
+        infection = self.Infections.pop(infection_id)
+        self.ClearedInfections[infection_id] = infection
+        self.infection_mask &= ~infection.Mask
+        self.cleared_mask |= infection.Mask
 
     def infection_natural_history(self):
+        if not self.infection_mask:
+            return
         infections_to_clear = []
         for infid, inf in self.Infections.items():
             prob_clear = inf.get_clearance()
-            rand = random.random()
+            rand = self.data.rng.transmission.random()
             if rand < prob_clear:
                 infections_to_clear.append(infid)
             else:
@@ -363,7 +712,7 @@ class Individual:
 
     def seed_infection(self):
         if 17 < self.age < 30:
-            rand = random.random()
+            rand = self.data.rng.transmission.random()
             if rand < 0.05:
                 self.acquire_infection(HPVoHRInfection)
             elif rand < 0.15:
@@ -373,16 +722,10 @@ class Individual:
             elif rand < 0.3:
                 self.acquire_infection(HPVLRInfection)
 
-    def natural_history(self):
-        rand = random.random()
-        if rand < self.get_mortality():
-            self.alive = False
-        else:
-            self.data.count_total_alive(self.age)
-            if len(self.Infections) == 0:
-                self.data.count_infection_denom(self.age)
-            else:
-                self.data.count_prevalent_infections(self.age)
+    def survive_month(self):
+        # after a survived mortality draw, which the model takes and counts
+        # for everyone at once (agent.natural_history)
+        if self.data.CLEARANCE == "monthly":
             self.infection_natural_history()
 
     def get_mortality(self):
@@ -390,73 +733,64 @@ class Individual:
 
 
 class Woman(Individual):
-    def __init__(
-            self,
-            age,
-            identifier,
-            data):
-        super(Woman, self).__init__(age, identifier, data)
-        self.gender = Gender.FEMALE
-        self.mortality = data.BACKGROUND_MORTALITY_FEMALE
-        self.concurrency = data.CONCURRENCY_FEMALE
+    __slots__ = ()
+    gender = Gender.FEMALE
+
+    @property
+    def concurrency(self):
+        return self.data.CONCURRENCY_FEMALE
 
     def get_mortality(self):
-        return self.mortality.iloc[self.age]["mASR"]
+        return self.data.MORTALITY_FEMALE[self.age]
 
     def add_partner(self, man, relationshiptype, partnerships):
-        partnership_id = uuid.uuid1()
-        partnerships[partnership_id] = relationshiptype(partnership_id, self, man, self.data)
+        partnership_id = next(Individual.ids)
+        partnership = partnerships[partnership_id] = relationshiptype(partnership_id, self, man, self.data)
         self.numpartners += 1
         self.partnershipid.append(partnership_id)
+        self.partners.add(man.id)
         man.partnershipid.append(partnership_id)
         man.numpartners += 1
+        if self.data.network is not None:
+            self.data.network.add_partnership(Individual.year, self.age, man.age,
+                                              relationshiptype.partnership_type.value)
+        return partnership
 
-    def check_eligibility(self, man, partnerships):
-        if man.alive:
-            alreadypartner = False
-            for key in self.partnershipid:
-                if partnerships[key].female_id == self.id and partnerships[key].male_id == man.id:
-                    if partnerships[key].active:
-                        alreadypartner = True
-            return not alreadypartner
-        else:
-            return False
+    def check_eligibility(self, man):
+        return man.alive and man.id not in self.partners
 
     def get_age_of_partner(self):
-        age = np.random.poisson(self.ageofpartner.iloc[self.age]["mean"], None)
-        while age > 75:
-            age = np.random.poisson(self.ageofpartner.iloc[self.age]["mean"], None)
-        return age
+        return bisect_right(self.data.PARTNER_AGE_CDF_ROWS[self.age], self.data.rng.partnering.random())
 
-    def create_partnership(self, lookup_table, partnerships):
+    def create_partnership(self, partner_index, partnerships):
+        # returns the new partnership, or None if no one was found
         ageofpartner = self.get_age_of_partner()
-        keys = list(lookup_table[ageofpartner].keys())
-        random.shuffle(keys)
         # lookup by eligibility
-        for m in keys:
-            if self.check_eligibility(lookup_table[ageofpartner][m], partnerships):
-                if lookup_table[ageofpartner][m].numpartners == 0:
+        for man in partner_index.candidates(ageofpartner, self.data.rng.partnering):
+            if self.check_eligibility(man):
+                if man.numpartners == 0:
                     relationship_type = self.assign_partnership_type(True)
-                    self.add_partner(lookup_table[ageofpartner][m], relationship_type, partnerships)
-                    lookup_table[ageofpartner][m].single = False
+                    partnership = self.add_partner(man, relationship_type, partnerships)
+                    man.single = False
                     self.single = False
                     self.numpartners += 1
-                    lookup_table[ageofpartner][m].numpartners += 1
-                    break
+                    man.numpartners += 1
+                    return partnership
                 else:
-                    rand = random.random()
-                    if rand < lookup_table[ageofpartner][m].concurrency:
+                    rand = self.data.rng.partnering.random()
+                    if rand < man.concurrency:
                         relationship_type = self.assign_partnership_type(False)
-                        self.add_partner(lookup_table[ageofpartner][m], relationship_type, partnerships)
-                        lookup_table[ageofpartner][m].single = False
+                        partnership = self.add_partner(man, relationship_type, partnerships)
+                        man.single = False
                         self.numpartners += 1
                         self.single = False
-                        lookup_table[ageofpartner][m].numpartners += 1
-                        break
+                        man.numpartners += 1
+                        return partnership
+        return None
 
     def assign_partnership_type(self, single):
         if single:
-            rand = random.random()
+            rand = self.data.rng.partnering.random()
             if rand < self.data.PROB_CASUAL:
                 return CasualRelationship
             elif rand < (self.data.PROB_CASUAL + self.data.PROB_MARITAL):
@@ -466,37 +800,35 @@ class Woman(Individual):
             else:
                 return InstantaneousRelationship
         else:
-            rand = random.random()
+            rand = self.data.rng.partnering.random()
             if rand < self.data.PROB_CASUAL:
                 return CasualRelationship
             else:
                 return InstantaneousRelationship
 
-    def run_partnerships(self, lookup_table, partnerships):
-        if self.sexualdebutage <= self.age <= 74:
+    def run_partnerships(self, partner_index, partnerships):
+        if self.data.SEXUAL_DEBUT_AGE <= self.age <= 74:
             if self.numpartners == 0:
-                rand = random.random()
-                if rand < self.partnershipformation.iloc[self.age]["Female"]:
-                    self.create_partnership(lookup_table, partnerships)
+                rand = self.data.rng.partnering.random()
+                if rand < self.data.FORMATION_FEMALE[self.age]:
+                    return self.create_partnership(partner_index, partnerships)
             else:
-                rand = random.random()
+                rand = self.data.rng.partnering.random()
                 if rand < self.concurrency:
-                    self.create_partnership(lookup_table, partnerships)
+                    return self.create_partnership(partner_index, partnerships)
+        return None
 
 
 class Man(Individual):
-    def __init__(
-            self,
-            age,
-            identifier,
-            data):
-        super(Man, self).__init__(age, identifier, data)
-        self.gender = Gender.MALE
-        self.mortality = data.BACKGROUND_MORTALITY_MALE
-        self.concurrency = data.CONCURRENCY_MALE
+    __slots__ = ()
+    gender = Gender.MALE
+
+    @property
+    def concurrency(self):
+        return self.data.CONCURRENCY_MALE
 
     def get_mortality(self):
-        return self.mortality.iloc[self.age]["mASR"]
+        return self.data.MORTALITY_MALE[self.age]
 
 
 class TimerError(Exception):
@@ -522,3 +854,4 @@ class Timer:
         elapsed_time = time.perf_counter() - self._start_time
         self._start_time = None
         print(f"Elapsed time: {elapsed_time:0.4f} seconds")
+        return elapsed_time
@@ -0,0 +1,382 @@
+import traceback
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from engine import ArrayEngine, Population, PartnershipTable, NULL_PROFILER, N_TYPES
+from sexualnetwork import PartnershipType
+from rng import RandomStreams
+
+# the Population arrays kept in shared memory
+FIELDS = ("female", "age", "month_age", "alive", "numpartners", "concurrency", "infected", "cleared", "timer")
+# the Data counters filled by count_survivors
+SURVIVOR_COUNTS = ("alive_counts", "uninfected_counts", "prevalent_counts", "type_prevalent_counts")
+
+
+class ShardedEngine(ArrayEngine):
+    """Runs one ArrayEngine population on SHARDS worker processes.
+
+    The Population arrays live in shared memory. Shard k owns every SHARDS-th
+    slot from k and the partnerships of the women in them, and runs mortality,
+    infection natural history, partner search, transmission draws, new
+    infections, dissolution and aging for those. The men sorted by age are
+    shared too, sorted here once a month for every shard to search. Partner
+    counts, and new infections of other shards' people, come back here
+    between the rounds of each month; counts are applied here and infections
+    passed on to the shards owning those people, so shards never write the
+    same slot.
+
+    Each shard draws from its own stream spawned from the run seed, so results
+    are reproducible for a given SHARDS but differ between values of SHARDS.
+    """
+
+    def __init__(self, data, archive=None):
+        if data.CHECKPOINT_INTERVAL:
+            raise ValueError("ENGINE = sharded does not support CHECKPOINT_INTERVAL")
+        if data.NETWORK_STATS:
+            raise ValueError("ENGINE = sharded does not support NETWORK_STATS")
+        super().__init__(data, archive)
+        pop = self.population
+        self.shards = max(1, min(data.SHARDS, pop.size))
+        self.men = np.flatnonzero(~pop.female)
+        arrays = {name: getattr(pop, name) for name in FIELDS}
+        arrays["men"] = self.men
+        self.blocks, specs = share(arrays)
+        for name in FIELDS:
+            setattr(pop, name, arrays[name])
+        self.men = arrays["men"]
+        context = multiprocessing.get_context("spawn")
+        self.connections = []
+        self.workers = []
+        try:
+            for k, seed in enumerate(data.rng.seed.spawn(self.shards)):
+                connection, child = context.Pipe()
+                self.connections.append(connection)
+                worker = context.Process(target=serve, args=(child, data, specs, pop.size, k, self.shards, seed),
+                                         daemon=True)
+                worker.start()
+                child.close()
+                self.workers.append(worker)
+        except BaseException:
+            for worker in self.workers:
+                worker.terminate()
+            # no views of the blocks may be left when they are closed
+            arrays.clear()
+            self.stopped()
+            raise
+
+    def partnership_table(self):
+        # every partnership lives in the Shard of its woman
+        return None
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """Stop the workers and move the population back into private memory"""
+        if not getattr(self, "blocks", None):
+            return
+        for connection in self.connections:
+            try:
+                connection.send(("stop", ()))
+            except OSError:
+                pass
+        self.stopped()
+
+    def stopped(self):
+        # once the workers have been told to stop: wait for them, and give the
+        # population private memory so the shared blocks can go
+        for worker in self.workers:
+            worker.join()
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
+        self.workers = []
+        pop = self.population
+        for name in FIELDS:
+            setattr(pop, name, np.array(getattr(pop, name)))
+        self.men = np.array(self.men)
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def call(self, command, *args_by_shard):
+        # run command on every shard at once, with one argument per shard from
+        # each of args_by_shard, and return their results
+        for k, connection in enumerate(self.connections):
+            connection.send((command, tuple(args[k] for args in args_by_shard)))
+        replies = [receive(connection) for connection in self.connections]
+        failed = [result for status, result in replies if status == "error"]
+        if failed:
+            self.close()
+            raise RuntimeError("shard failed in %s:\n%s" % (command, failed[0]))
+        return [result for _, result in replies]
+
+    def step(self, profiler=NULL_PROFILER):
+        pop = self.population
+        data = self.data
+        month = self.month
+        profiler.start()
+        attempted = data.transmissions_attempted
+
+        # the men sorted by age, for the shards' partner searches
+        men, bounds = self.men_by_age()
+        self.men[:] = men
+        proposals = self.call("propose", [bounds] * self.shards)
+        formed = 0
+        while any(len(female) for female, _, _ in proposals):
+            accepted, ptypes = self.resolve(proposals)
+            formed += sum(int(a.sum()) for a in accepted)
+            proposals = self.call("settle", accepted, ptypes)
+        profiler.lap("female")
+        for counts in self.call("accept"):
+            for name, values in zip(SURVIVOR_COUNTS, counts):
+                getattr(data, name)[..., self.year] += values
+        data.next_clearance_month = month + 1
+        profiler.lap("male")
+
+        # women infected this month can already pass it on to their partners;
+        # each round's new infections are taken on by their owners in the next
+        results = self.call("infect_women")
+        data.transmissions_attempted += sum(n for _, n in results)
+        results = self.call("infect_men", self.route(np.concatenate([acquired for acquired, _ in results])))
+        data.transmissions_attempted += sum(n for _, n in results)
+        results = self.call("end_partnerships", self.route(np.concatenate([acquired for acquired, _ in results])))
+        profiler.lap("relationships")
+        for female, male, records in results:
+            np.subtract.at(pop.numpartners, female, 1)
+            np.subtract.at(pop.numpartners, male, 1)
+            if self.archive is not None and len(records):
+                self.archive.add_dissolutions(records)
+        profiler.lap("cleanup")
+
+        for records, incident in self.call("age"):
+            data.incident_counts[..., self.year] += incident
+            if self.archive is not None and len(records):
+                self.archive.add_deaths(records)
+        self.month += 1
+        if self.month % 12 == 0:
+            self.year += 1
+        if self.month >= data.SIM_MONTHS:
+            self.close()
+        profiler.lap("aging")
+
+        profiler.count(formed=formed, dissolved=sum(len(female) for female, _, _ in results),
+                       population=pop.size, transmissions=data.transmissions_attempted - attempted)
+        profiler.end_month(month)
+
+    def resolve(self, proposals):
+        # Shards match their women against the men as they were at the start
+        # of the month, so two shards can both take a man as his first partner.
+        # Those proposals are replayed in random order: the first stands, and
+        # each later one is accepted with the man's concurrency and given a
+        # partnership type for a man who already has a partner. The women
+        # refused search again in the next round, as they would have gone on
+        # to the next man of their bucket.
+        pop = self.population
+        lengths = [len(male) for _, male, _ in proposals]
+        female = np.concatenate([female for female, _, _ in proposals])
+        male = np.concatenate([male for _, male, _ in proposals])
+        ptype = np.concatenate([ptype for _, _, ptype in proposals])
+        shard = np.repeat(np.arange(self.shards), lengths)
+        accepted = np.ones(len(male), dtype=bool)
+
+        # within a shard only the first proposal to a man can find him single
+        first = np.zeros(len(male), dtype=bool)
+        first[np.unique(shard * pop.size + male, return_index=True)[1]] = True
+        claims = np.flatnonzero(first & (pop.numpartners[male] == 0))
+        men, claimed = np.unique(male[claims], return_counts=True)
+        contested = claims[np.isin(male[claims], men[claimed > 1])]
+        contested = contested[self.partnering.permutation(len(contested))]
+        later = np.ones(len(contested), dtype=bool)
+        later[np.unique(male[contested], return_index=True)[1]] = False
+        later = contested[later]
+        willing = self.partnering.random(len(later)) < pop.concurrency[male[later]]
+        accepted[later[~willing]] = False
+        # partnership_type(False) for each
+        casual = self.partnering.random(int(willing.sum())) < self.data.PROB_CASUAL
+        ptype[later[willing]] = np.where(casual, PartnershipType.CASUAL.value, PartnershipType.INSTANTANEOUS.value)
+
+        np.add.at(pop.numpartners, female[accepted], 2)
+        np.add.at(pop.numpartners, male[accepted], 2)
+        bounds = np.cumsum(lengths)[:-1]
+        return np.split(accepted, bounds), np.split(ptype, bounds)
+
+    def route(self, acquired):
+        # split new infections, coded as person * N_TYPES + type, by the shard
+        # owning the person
+        owner = acquired // N_TYPES % self.shards
+        order = np.argsort(owner, kind="stable")
+        return np.split(acquired[order], np.searchsorted(owner[order], np.arange(1, self.shards)))
+
+
+class Shard(ArrayEngine):
+    """The part of a ShardedEngine run in one worker process.
+
+    Works on the shared population in place, but only writes to the slots it
+    owns; everything else is returned to the ShardedEngine to apply.
+    """
+
+    def __init__(self, data, population, men, k, shards, seed):
+        data.rng = RandomStreams(seed, data.RNG_BLOCK_SIZE)
+        data.transmissions_attempted = 0
+        for name in SURVIVOR_COUNTS + ("incident_counts",):
+            getattr(data, name)[...] = 0
+        self.data = data
+        self.archive = None
+        self.month = 0
+        self.year = 0
+        self.n_ages = data.N_AGES
+        self.population = None
+        self.refresh_parameters()
+        self.population = population
+        self.men_sorted = men
+        owned = np.arange(k, population.size, shards)
+        self.women = owned[population.female[owned]]
+        self.men = owned[~population.female[owned]]
+        self.partnerships = PartnershipTable(population.size)
+        self.bounds = None
+        self.proposals = None
+        self.live = None
+
+    def propose(self, bounds):
+        # bounds: the age bounds of the men_sorted shared by the ShardedEngine
+        self.natural_history(self.women, self.data.MORTALITY_FEMALE)
+        self.bounds = bounds
+        return self.proposed(self.seekers(self.women))
+
+    def proposed(self, seekers, partner_ages=None):
+        # match against a private copy of the partner counts, so the men this
+        # shard takes count as partnered for its later women only
+        pop = self.population
+        shared = pop.numpartners
+        pop.numpartners = shared.copy()
+        try:
+            self.proposals = self.match(seekers, self.men_sorted, self.bounds, partner_ages)
+        finally:
+            pop.numpartners = shared
+        return self.proposals
+
+    def settle(self, accepted, ptype):
+        # form the accepted partnerships and propose again for the women
+        # refused, in the same age bucket
+        female, male, _ = self.proposals
+        self.add_partnerships(female[accepted], male[accepted], ptype[accepted])
+        refused = ~accepted
+        return self.proposed(female[refused], self.population.age[male[refused]])
+
+    def accept(self):
+        self.natural_history(self.men, self.data.MORTALITY_MALE)
+        self.data.next_clearance_month = self.month + 1
+        return self.take_counts(SURVIVOR_COUNTS)
+
+    def take_counts(self, names):
+        # this year's Data counters named, which are then reset for the next call
+        counts = [getattr(self.data, name)[..., self.year].copy() for name in names]
+        for name in names:
+            getattr(self.data, name)[..., self.year] = 0
+        return counts
+
+    def infect_women(self):
+        ps = self.partnerships
+        self.live = self.live_partnerships()
+        return self.transmissions(ps.male[self.live], ps.female[self.live])
+
+    def infect_men(self, acquired):
+        # acquired: the women of this shard infected by infect_women
+        self.acquire_coded(acquired)
+        ps = self.partnerships
+        return self.transmissions(ps.female[self.live], ps.male[self.live])
+
+    def transmissions(self, source, target):
+        acquired = self.infect(source, target, self.partnerships.sexacts[self.live])
+        attempted = self.data.transmissions_attempted
+        self.data.transmissions_attempted = 0
+        return acquired, attempted
+
+    def end_partnerships(self, acquired):
+        # acquired: the men of this shard infected by infect_men
+        self.acquire_coded(acquired)
+        ps = self.partnerships
+        ending = self.ending_partnerships()
+        female, male = ps.female[ending], ps.male[ending]
+        records = self.dissolution_records(ending)
+        ps.remove(ending)
+        return female, male, records
+
+    def age(self):
+        pop = self.population
+        owned = np.concatenate([self.women, self.men])
+        alive = owned[pop.alive[owned]]
+        pop.month_age[alive] += 1
+        pop.age[alive[pop.month_age[alive] % 12 == 0]] += 1
+        dead = owned[~pop.alive[owned]]
+        records = self.death_records(dead)
+        pop.reset(dead)
+        incident, = self.take_counts(("incident_counts",))
+        self.month += 1
+        if self.month % 12 == 0:
+            self.year += 1
+        return records, incident
+
+
+def receive(connection):
+    try:
+        return connection.recv()
+    except EOFError:
+        return "error", "worker exited"
+
+
+def share(arrays):
+    # move the arrays of a dict into shared memory, in place; returns the
+    # blocks and what a worker needs to attach to them
+    blocks = []
+    try:
+        for array in arrays.values():
+            blocks.append(shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1)))
+    except BaseException:
+        for block in blocks:
+            block.close()
+            block.unlink()
+        raise
+    specs = []
+    for (name, array), block in zip(list(arrays.items()), blocks):
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+        shared[...] = array
+        arrays[name] = shared
+        specs.append((name, block.name, array.shape, array.dtype.str))
+    return blocks, specs
+
+
+def attach(specs):
+    # the shared arrays by name, and their blocks
+    arrays = {}
+    blocks = []
+    for name, block_name, shape, dtype in specs:
+        block = shared_memory.SharedMemory(name=block_name)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        blocks.append(block)
+    return arrays, blocks
+
+
+def serve(connection, data, specs, size, k, shards, seed):
+    # worker loop: run the Shard method named by each command until "stop"
+    arrays, blocks = attach(specs)
+    pop = Population.__new__(Population)
+    pop.size = size
+    for name in FIELDS:
+        setattr(pop, name, arrays[name])
+    shard = Shard(data, pop, arrays["men"], k, shards, seed)
+    while True:
+        command, args = connection.recv()
+        if command == "stop":
+            break
+        try:
+            connection.send(("ok", getattr(shard, command)(*args)))
+        except Exception:
+            connection.send(("error", traceback.format_exc()))
+    # the arrays must go before the blocks they view can be closed
+    del shard, pop, arrays
+    for block in blocks:
+        block.close()
+    connection.close()
@@ -0,0 +1,170 @@
+"""Parameter sweeps and calibration runs.
+
+A sweep ini file has three sections: [model] with a complete set of model
+parameters, [sweep] describing the design, and [parameters] giving the values
+to vary. Each [parameters] entry is either a list of levels (0.2, 0.4, 0.6) or
+a range low:high. A grid design runs every combination, with GRID_STEPS evenly
+spaced values for each range; an lhs design runs POINTS Latin hypercube points,
+uniform over ranges and spread evenly over lists of levels.
+
+    python sweep.py calibration.ini --workers 8
+
+With BURN_IN = n the [model] parameters are run once for n months and every
+point branches from that population. With PREVALENCE_MIN/PREVALENCE_MAX a
+point stops at the first year whose prevalence at PREVALENCE_AGES leaves the
+band. One row per point, with its parameter values, is written to
+sweep_<ini file>.csv.
+"""
+import os
+import csv
+import argparse
+import itertools
+import configparser
+from functools import partial
+import numpy as np
+from sexualnetwork import Data
+from archive import Archive
+from checkpoint import save_checkpoint
+from main import make_model, make_jobs, run_jobs, run_job, warm_table_cache
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the model over a grid or Latin hypercube of parameter values.")
+    parser.add_argument("filename", help="sweep ini file with [model], [sweep] and [parameters] sections")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes to run points on (default: 1)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = configparser.ConfigParser()
+    config.read(args.filename)
+    name = os.path.splitext(os.path.basename(args.filename))[0]
+    model, sweep = config["model"], config["sweep"]
+
+    points = design(config["parameters"], sweep)
+    runs = configparser.ConfigParser()
+    for k, point in enumerate(points):
+        runs.read_dict({"%s_%03d" % (name, k): dict(model, **point)})
+    if args.workers > 1:
+        warm_table_cache(runs[section] for section in runs.sections())
+    checkpoint = burn_in(model, int(sweep.get("BURN_IN", "0")), name)
+    jobs = []
+    for section in runs.sections():
+        jobs.extend(make_jobs(section, runs[section], checkpoint))
+    run = run_job
+    if "PREVALENCE_MIN" in sweep or "PREVALENCE_MAX" in sweep:
+        low, high = float(sweep.get("PREVALENCE_MIN", "0")), float(sweep.get("PREVALENCE_MAX", "1"))
+        ages = parse_ages(sweep.get("PREVALENCE_AGES", ""))
+        run = partial(run_job, stop=PrevalenceBand(low, high, ages, int(sweep.get("BURN_IN", "0")) // 12))
+    results = run_jobs(jobs, args.workers, run)
+
+    # the jobs of a point are consecutive, one per replicate
+    replicates = len(jobs) // len(points) if points else 1
+    for k, result in enumerate(results):
+        result.update(points[k // replicates])
+    write_results("sweep_" + name + ".csv", results, list(config["parameters"]))
+
+
+def design(parameters, sweep):
+    """The points of the sweep, as dicts of parameter name to ini value"""
+    names = list(parameters)
+    values = [parse_values(parameters[name]) for name in names]
+    kind = sweep.get("DESIGN", "grid")
+    if kind == "grid":
+        steps = int(sweep.get("GRID_STEPS", "3"))
+        levels = [v if isinstance(v, list) else list(np.linspace(v[0], v[1], steps)) for v in values]
+        rows = list(itertools.product(*levels))
+    elif kind == "lhs":
+        n = int(sweep["POINTS"])
+        rng = np.random.default_rng(None if sweep.get("SEED") is None else int(sweep["SEED"]))
+        # one stratum per point in each dimension, in an independent random order
+        u = (np.array([rng.permutation(n) for _ in names]).T + rng.random((n, len(names)))) / n
+        rows = [[v[int(x * len(v))] if isinstance(v, list) else v[0] + x * (v[1] - v[0])
+                 for x, v in zip(row, values)] for row in u.tolist()]
+    else:
+        raise ValueError("unknown DESIGN %r" % kind)
+    return [{name: format_value(value, parameters[name]) for name, value in zip(names, row)} for row in rows]
+
+
+def parse_values(text):
+    # "low:high" as a (low, high) range, otherwise a list of levels
+    if ":" in text:
+        low, high = text.split(":")
+        return float(low), float(high)
+    return [value.strip() for value in text.split(",")]
+
+
+def format_value(value, text):
+    # values of ranges whose ends are both whole numbers stay whole, since
+    # parameters such as DUR_MARITAL are read with int()
+    if isinstance(value, str):
+        return value
+    if "." not in text:
+        return str(int(round(value)))
+    return repr(round(float(value), 12))
+
+
+def parse_ages(text):
+    # "low:high" as a slice of ages, inclusive; empty for every age
+    if not text:
+        return slice(None)
+    low, high = text.split(":")
+    return slice(int(low), int(high) + 1)
+
+
+def burn_in(params, months, name):
+    """Run the base parameters for months and checkpoint them; returns the file.
+
+    Every point then starts from this population with its own parameters, so
+    the demographic and partnership burn-in is paid for once.
+    """
+    if not months:
+        return None
+    section = configparser.ConfigParser()
+    section.read_dict({name: dict(params)})
+    data = Data(section[name])
+    if data.ENGINE == "sharded":
+        raise ValueError("BURN_IN needs a checkpoint, which ENGINE = sharded does not support")
+    model = make_model(data, Archive("drop", name + "_burnin", data.N_AGES))
+    while model.month < months:
+        model.step()
+    filename = data.CHECKPOINT_FILE.format(run=name + "_burnin")
+    save_checkpoint(filename, model, {"run": name + "_burnin", "section": name, "replicate": 0})
+    return filename
+
+
+class PrevalenceBand:
+    """Stops a run at the end of the first year whose prevalence is out of band.
+
+    Prevalence is person-months infected over person-months alive at ages,
+    from Data.prevalentinfections and Data.totalalive. Years before
+    first_year (the burn-in) are not checked.
+    """
+
+    def __init__(self, low, high, ages=slice(None), first_year=0):
+        self.low = low
+        self.high = high
+        self.ages = ages
+        self.first_year = first_year
+
+    def __call__(self, data, summary):
+        year = summary["year"]
+        if summary["month"] % 12 != 11 or year < self.first_year:
+            return False
+        alive = data.totalalive[self.ages, year].sum()
+        prevalence = data.prevalentinfections[self.ages, year].sum() / alive if alive else 0.0
+        return not self.low <= prevalence <= self.high
+
+
+def write_results(filename, results, parameters):
+    fields = ["run", "replicate"] + parameters + ["incident", "uninfected", "prevalent", "alive", "stopped",
+                                                  "seconds", "cached", "entropy"]
+    with open(filename, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import os
+import hashlib
+from contextlib import contextmanager
+import numpy as np
+
+DEFAULT_TABLE_CACHE = "table_cache"
+# bump when parse_csv changes, so stale cache entries are not used
+CACHE_VERSION = 1
+
+
+def parse_csv(filename):
+    # numeric CSV with a header row, as a float structured array with one
+    # field per column
+    with open(filename, encoding="utf-8-sig") as f:
+        names = [name.strip() for name in f.readline().split(",")]
+        values = np.loadtxt(f, delimiter=",", dtype=float, ndmin=2)
+    table = np.zeros(len(values), dtype=[(name, float) for name in names])
+    for k, name in enumerate(names):
+        table[name] = values[:, k]
+    return table
+
+
+def as_frame(table):
+    # a structured array as a pandas DataFrame; pandas is only imported here
+    import pandas as pd
+    return pd.DataFrame(table)
+
+
+def content_hash(filename):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_table(filename, cache_dir=DEFAULT_TABLE_CACHE):
+    """An input CSV as a read-only structured array.
+
+    The parsed table is saved to cache_dir under the hash of the file's
+    contents, and later reads memory-map that copy, so workers running the
+    same inputs share its pages and never parse the CSV again. An empty
+    cache_dir parses the CSV every time.
+    """
+    if not cache_dir:
+        return parse_csv(filename)
+    cached = os.path.join(cache_dir, "%s.v%d.npy" % (content_hash(filename), CACHE_VERSION))
+    if not os.path.exists(cached):
+        os.makedirs(cache_dir, exist_ok=True)
+        with atomic_write(cached) as f:
+            np.save(f, parse_csv(filename))
+    return np.load(cached, mmap_mode="r")
+
+
+@contextmanager
+def atomic_write(filename):
+    """A binary file that replaces filename once it has been written.
+
+    Concurrent workers each write their own temporary file and the last
+    rename wins, so readers never see a partly written file.
+    """
+    temporary = "%s.%d.tmp" % (filename, os.getpid())
+    try:
+        with open(temporary, "wb") as f:
+            yield f
+        os.replace(temporary, filename)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
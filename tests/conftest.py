@@ -0,0 +1,70 @@
+import os
+import sys
+import configparser
+import numpy as np
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from sexualnetwork import Data
+from archive import Archive
+from main import make_model
+
+
+@pytest.fixture
+def params(tmp_path, monkeypatch):
+    # a small run of the example model, writing its outputs into tmp_path
+    monkeypatch.chdir(tmp_path)
+    return {
+        "COHORT_SIZE": "2000",
+        "SIM_YEARS": "2",
+        "CYCLE_LENGTH": "12",
+        "CONCURRENCY_MALE": "0.2",
+        "CONCURRENCY_FEMALE": "0.05",
+        "PROB_MARITAL": "0.3",
+        "PROB_CASUAL": "0.4",
+        "PROB_SHORT_TERM": "0.2",
+        "PROB_INSTANTANEOUS": "0.1",
+        "DUR_MARITAL": "40",
+        "DUR_CASUAL": "1",
+        "DUR_SHORT_TERM": "3",
+        "SEX_PER_MONTH_MARITAL": "8",
+        "SEX_PER_MONTH_CASUAL": "10",
+        "SEX_PER_MONTH_SHORT_TERM": "11",
+        "BACKGROUND_MORTALITY_FEMALE_FILE": os.path.join(REPO, "mASR_female.csv"),
+        "BACKGROUND_MORTALITY_MALE_FILE": os.path.join(REPO, "mASR_male.csv"),
+        "AGE_OF_PARTNER_FILE": os.path.join(REPO, "ageofpartner.csv"),
+        "PARTNERSHIP_FORMATION_FILE": os.path.join(REPO, "partnershipformation.csv"),
+        "INITIAL_POPULATION_FILE": os.path.join(REPO, "pop_init.csv"),
+        "HPV_CLEARANCE_FILE": os.path.join(REPO, "hpvclearance.csv"),
+        "SEXUAL_DEBUT_AGE": "15",
+        "TRANSMISSION_PER_SEX_ACT": "0.4",
+        "NATURAL_IMMUNITY_HPV16": "0.45",
+        "NATURAL_IMMUNITY_HPV18": "0.45",
+        "NATURAL_IMMUNITY_HPVoHR": "0.45",
+        "NATURAL_IMMUNITY_HPVLR": "0.45",
+        "SEED": "7",
+    }
+
+
+@pytest.fixture
+def simulate(params):
+    # simulate(**options) runs params with options to the end and returns its Data
+    def run(**options):
+        section = dict(params, RETENTION="drop")
+        section.update(options)
+        parser = configparser.ConfigParser()
+        parser.read_dict({"test": section})
+        data = Data(parser["test"])
+        model = make_model(data, Archive("drop", "test", data.N_AGES))
+        while model.month < data.SIM_MONTHS:
+            model.step()
+        return data
+    return run
+
+
+def prevalence(runs):
+    # mean and standard error over runs of the prevalent share of person-months
+    shares = np.array([data.prevalent_counts.sum() / data.alive_counts.sum() for data in runs])
+    return shares.mean(), shares.std(ddof=1) / np.sqrt(len(shares))
@@ -0,0 +1,77 @@
+import configparser
+import numpy as np
+import pytest
+from sexualnetwork import Data
+from archive import Archive, ArchiveError, RecordLog, PERSON_FIELDS, PARTNERSHIP_FIELDS
+from main import make_model
+
+
+def run_archived(params, mode, engine, buffer_size=10000):
+    # runs params to the end with an archive in mode and closes it
+    parser = configparser.ConfigParser()
+    parser.read_dict({"test": dict(params, ENGINE=engine, RETENTION=mode)})
+    data = Data(parser["test"])
+    model = make_model(data, Archive(mode, engine, data.N_AGES, buffer_size))
+    while model.month < data.SIM_MONTHS:
+        model.step()
+    model.archive.close()
+    return data
+
+
+def read_log(filename):
+    return np.loadtxt(filename, delimiter=",", skiprows=1, dtype=np.int64, ndmin=2)
+
+
+@pytest.mark.parametrize("engine", ["agent", "array"])
+def test_counts_tally_the_log(params, engine):
+    # the same seed gives the same run, so the counts are the log summed up
+    data = run_archived(params, "counts", engine)
+    run_archived(params, "log", engine)
+    dead = read_log("dead_" + engine + ".csv")
+    assert len(dead) > 0
+    deaths = np.zeros((2, data.N_AGES), dtype=np.int64)
+    np.add.at(deaths, (dead[:, 1], dead[:, 2]), 1)
+    counted = np.loadtxt("deaths_" + engine + ".csv", delimiter=",", skiprows=1, dtype=np.int64)
+    assert np.array_equal(counted, deaths[::-1].T)
+    partnerships = read_log("partnerships_" + engine + ".csv")
+    summary = np.loadtxt("dissolutions_" + engine + ".csv", delimiter=",", skiprows=1, dtype=np.int64)
+    for kind, count, months in summary:
+        dissolved = partnerships[partnerships[:, 1] == kind]
+        assert count == len(dissolved)
+        assert months == dissolved[:, 2].sum()
+    assert summary[:, 1].sum() == len(partnerships)
+
+
+def test_log_does_not_depend_on_the_buffer(params):
+    run_archived(params, "log", "agent", buffer_size=7)
+    small = [read_log(name + "_agent.csv") for name in ("dead", "partnerships")]
+    run_archived(params, "log", "agent")
+    for name, records in zip(("dead", "partnerships"), small):
+        assert np.array_equal(read_log(name + "_agent.csv"), records)
+
+
+def test_record_log_buffers_at_most_its_size(tmp_path):
+    log = RecordLog(str(tmp_path / "log.csv"), PARTNERSHIP_FIELDS, 3)
+    log.append(np.arange(35).reshape(7, 5))
+    # two full buffers went to disk, the seventh record is still held
+    assert log.used == 1
+    assert len(read_log(log.filename)) == 6
+    log.flush()
+    assert log.used == 0
+    assert np.array_equal(read_log(log.filename), np.arange(35).reshape(7, 5))
+
+
+def test_record_log_truncates_to_the_last_flush(tmp_path):
+    log = RecordLog(str(tmp_path / "log.csv"), PERSON_FIELDS, 10)
+    log.append(np.ones((2, 6), dtype=np.int64))
+    log.flush()
+    # rows written after the flush, e.g. by a run that crashed later on
+    with open(log.filename, "a") as f:
+        f.write("9,9,9,9,9,9\n")
+    log.truncate()
+    assert np.array_equal(read_log(log.filename), np.ones((2, 6), dtype=np.int64))
+
+
+def test_unknown_retention():
+    with pytest.raises(ArchiveError):
+        Archive("everything", "test", 2)
@@ -0,0 +1,34 @@
+import os
+from main import make_jobs, run_job, job_cache
+
+
+def read(filename):
+    with open(filename) as f:
+        return f.read()
+
+
+def test_hit_under_a_renamed_section(params, tmp_path):
+    params.update(ENGINE="array", NETWORK_STATS="true", RESULT_CACHE=str(tmp_path / "cache"))
+    job, = make_jobs("first", params)
+    first = run_job(job)
+    job, = make_jobs("renamed", params)
+    renamed = run_job(job)
+
+    assert not first["cached"] and renamed["cached"]
+    assert renamed["run"] == renamed["section"] == "renamed"
+    for name in ("entropy", "incident", "uninfected", "prevalent", "alive"):
+        assert renamed[name] == first[name]
+    for output in ("incidence_{}.csv", "prevalence_{}.csv", "network_{}.csv"):
+        assert read(output.format("renamed")) == read(output.format("first"))
+
+
+def test_sharded_key_uses_the_number_of_shards(params, monkeypatch):
+    params.update(ENGINE="sharded", SHARDS="0")
+    job, = make_jobs("sharded", params)
+    keys = {}
+    for cpus in (2, 4):
+        monkeypatch.setattr(os, "cpu_count", lambda cpus=cpus: cpus)
+        keys[cpus] = job_cache(job)[1]
+    assert keys[2] != keys[4]
+    job, = make_jobs("sharded", dict(params, SHARDS="4"))
+    assert job_cache(job)[1] == keys[4]
@@ -0,0 +1,44 @@
+import configparser
+import numpy as np
+import pytest
+from sexualnetwork import Data
+from conftest import prevalence
+
+
+def section(params):
+    parser = configparser.ConfigParser()
+    parser.read_dict({"test": params})
+    return parser["test"]
+
+
+@pytest.mark.parametrize("value", ["Sampled", "montly", ""])
+def test_unknown_clearance_is_an_error(params, value):
+    params["CLEARANCE"] = value
+    with pytest.raises(ValueError, match="CLEARANCE"):
+        Data(section(params))
+
+
+def test_sampled_checks_follow_the_monthly_hazard(params):
+    # an infection survives check k when u is below the chance of surviving
+    # checks 1 to k, so the checks survived count those survival values
+    data = Data(section(params))
+    for hpv in range(data.CLEARANCE_SURVIVAL.shape[1]):
+        survival = data.CLEARANCE_SURVIVAL[:, hpv]
+        # below the last survival value the tail hazard takes over
+        u = np.linspace(0.001, 0.999, 500)
+        u = u[u > survival[-1]]
+        assert np.array_equal(data.clearance_checks(hpv, u), (survival[:, None] > u).sum(axis=0))
+
+
+@pytest.mark.parametrize("engine", ["agent", "array"])
+def test_sampled_agrees_with_monthly(simulate, engine):
+    runs = {clearance: [simulate(ENGINE=engine, CLEARANCE=clearance, SIM_YEARS="3", SEED=str(seed))
+                        for seed in range(8)] for clearance in ("monthly", "sampled")}
+    (monthly, monthly_se), (sampled, sampled_se) = prevalence(runs["monthly"]), prevalence(runs["sampled"])
+    assert abs(sampled - monthly) < 4 * np.hypot(monthly_se, sampled_se)
+
+
+def test_clearance_queue_holds_no_people(simulate):
+    data = simulate(ENGINE="agent", CLEARANCE="sampled", HYBRID="true", SIM_YEARS="3")
+    assert len(data.clearances)
+    assert all(isinstance(person, int) for _, _, (person, _) in data.clearances.heap)
@@ -0,0 +1,12 @@
+import configparser
+import pytest
+from sexualnetwork import Data
+
+
+@pytest.mark.parametrize("value", ["arrays", "Array", ""])
+def test_unknown_engine_is_an_error(params, value):
+    params["ENGINE"] = value
+    parser = configparser.ConfigParser()
+    parser.read_dict({"test": params})
+    with pytest.raises(ValueError, match="ENGINE"):
+        Data(parser["test"])
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+from agent import FOLD_AGE_MALE
+from conftest import prevalence
+
+
+def test_hybrid_agrees_with_agents(simulate):
+    runs = {hybrid: [simulate(ENGINE="agent", HYBRID=hybrid, SIM_YEARS="3", SEED=str(seed)) for seed in range(8)]
+            for hybrid in ("false", "true")}
+    (agents, agents_se), (hybrid, hybrid_se) = prevalence(runs["false"]), prevalence(runs["true"])
+    assert abs(hybrid - agents) < 4 * np.hypot(agents_se, hybrid_se)
+    # the people kept as counts are still counted: children, the ages with
+    # partners and everyone (the old alone are too few in so small a cohort)
+    bands = {}
+    for key, datas in runs.items():
+        by_age = np.mean([data.alive_counts.sum(axis=(0, 2)) for data in datas], axis=0)
+        bands[key] = [by_age[:15].sum(), by_age[15:FOLD_AGE_MALE].sum(), by_age.sum()]
+    assert bands["true"] == pytest.approx(bands["false"], rel=0.02)
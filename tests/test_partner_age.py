@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from sexualnetwork import partner_age_cdf, MAX_PARTNER_AGE
+
+MEANS = [0.0, 0.5, 3.0, 20.0, 45.0, 74.0, 80.0]
+SDS = [1.0, 2.0, 5.0, 10.0, 3.0, 4.0, 6.0]
+
+
+def rejection_sample(model, mean, sd, rng, n=100000):
+    # draws until in range, as the model did before the CDF: Poisson, or a
+    # normal rounded to the nearest age
+    kept = np.empty(0, dtype=np.int64)
+    while len(kept) < n:
+        if model == "poisson":
+            draws = rng.poisson(mean, n)
+        else:
+            draws = np.rint(rng.normal(mean, sd, n)).astype(np.int64)
+        kept = np.concatenate([kept, draws[(draws >= 0) & (draws <= MAX_PARTNER_AGE)]])
+    return kept[:n]
+
+
+@pytest.mark.parametrize("model", ["poisson", "normal"])
+def test_cdf_matches_rejection_sampling(model):
+    rng = np.random.default_rng(3)
+    cdf = partner_age_cdf(MEANS, SDS, model)
+    assert cdf.shape == (len(MEANS), MAX_PARTNER_AGE + 1)
+    assert np.all(np.diff(cdf, axis=1) >= 0) and np.all(cdf[:, -1] == 1)
+    for row, mean, sd in zip(cdf, MEANS, SDS):
+        draws = rejection_sample(model, mean, sd, rng)
+        empirical = np.cumsum(np.bincount(draws, minlength=MAX_PARTNER_AGE + 1)) / len(draws)
+        # just above the 1% Kolmogorov-Smirnov bound of 0.0052 for 100000 draws
+        assert np.abs(empirical - row).max() < 0.006
+
+
+def test_normal_needs_sd():
+    with pytest.raises(ValueError, match="SD"):
+        partner_age_cdf(MEANS, None, "normal")
+
+
+def test_unknown_model_is_an_error():
+    with pytest.raises(ValueError, match="PARTNER_AGE_MODEL"):
+        partner_age_cdf(MEANS, SDS, "gamma")
@@ -0,0 +1,42 @@
+import numpy as np
+from engine import PartnershipTable
+
+# people 0 to WOMEN - 1 are women and the rest men, as one chain head each
+WOMEN = 20
+PEOPLE = 40
+
+
+def check(table, reference):
+    # reference: {slot: (woman, man)} of the active partnerships
+    assert len(table) == len(reference)
+    assert sorted(table.slots().tolist()) == sorted(reference)
+    for person in range(PEOPLE):
+        female = person < WOMEN
+        expected = sorted(slot for slot, pair in reference.items() if person in pair)
+        assert sorted(table.partners(person, female)) == expected
+    pairs = set(reference.values())
+    for woman in range(WOMEN):
+        for man in range(WOMEN, PEOPLE):
+            assert table.linked(woman, man) == ((woman, man) in pairs)
+
+
+def test_add_remove_link():
+    rng = np.random.default_rng(1)
+    table = PartnershipTable(PEOPLE, capacity=4)
+    reference = {}
+    for _ in range(300):
+        if reference and rng.random() < 0.45:
+            slots = np.array(sorted(reference), dtype=np.int32)
+            slots = rng.choice(slots, size=rng.integers(1, len(slots) + 1), replace=False)
+            table.remove(slots)
+            for slot in slots.tolist():
+                del reference[slot]
+        else:
+            n = int(rng.integers(1, 6))
+            female = rng.integers(0, WOMEN, n)
+            male = rng.integers(WOMEN, PEOPLE, n)
+            slots = table.add(female, male, np.ones(n, dtype=np.int8), 0, np.zeros(n), np.ones(n))
+            assert not set(slots.tolist()) & set(reference)
+            reference.update(zip(slots.tolist(), zip(female.tolist(), male.tolist())))
+        check(table, reference)
+    assert table.capacity > 4
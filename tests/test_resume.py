@@ -0,0 +1,27 @@
+import os
+import pytest
+from main import make_jobs, run_job, resume_job
+
+
+def read(filename):
+    with open(filename) as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("engine", ["agent", "array"])
+def test_resume_gives_the_same_outputs(params, engine, tmp_path):
+    params.update(ENGINE=engine, CHECKPOINT_INTERVAL="12", RESULT_CACHE="")
+    job, = make_jobs("whole", params)
+    whole = run_job(job)
+
+    os.mkdir(tmp_path / "resumed")
+    os.chdir(tmp_path / "resumed")
+    job, = make_jobs("whole", params)
+    stopped = run_job(job, stop=lambda data, summary: summary["month"] == 11)
+    assert stopped["stopped"] == 11
+    resumed = resume_job("checkpoint_whole.pkl.gz")
+
+    for name in ("incident", "uninfected", "prevalent", "alive"):
+        assert resumed[name] == whole[name]
+    for filename in ("incidence_whole.csv", "prevalence_whole.csv"):
+        assert read(filename) == read(tmp_path / filename)
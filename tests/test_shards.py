@@ -0,0 +1,50 @@
+import os
+import glob
+import configparser
+from multiprocessing.context import SpawnProcess
+import numpy as np
+import pytest
+from sexualnetwork import Data
+from archive import Archive
+from shards import ShardedEngine
+from conftest import prevalence
+
+
+def section(params):
+    parser = configparser.ConfigParser()
+    parser.read_dict({"test": params})
+    return parser["test"]
+
+
+@pytest.mark.skipif(not os.path.isdir("/dev/shm"), reason="needs /dev/shm to list shared memory")
+def test_failed_start_releases_shared_memory(params, monkeypatch):
+    data = Data(section(dict(params, ENGINE="sharded", SHARDS="3")))
+    start = SpawnProcess.start
+    started = []
+
+    def start_two(process):
+        if len(started) == 2:
+            raise OSError("no more processes")
+        started.append(process)
+        start(process)
+
+    monkeypatch.setattr(SpawnProcess, "start", start_two)
+    before = set(glob.glob("/dev/shm/psm_*"))
+    # the traceback kept by excinfo keeps the engine alive, so its blocks
+    # must have gone before the error left __init__
+    with pytest.raises(OSError) as excinfo:
+        ShardedEngine(data, Archive("drop", "test", data.N_AGES))
+    assert set(glob.glob("/dev/shm/psm_*")) <= before
+    assert not any(process.is_alive() for process in started)
+    del excinfo
+
+
+def test_sharded_agrees_with_array(simulate):
+    # contested partners and the rounds of each month change the draws, so
+    # the engines only agree in distribution
+    runs = {engine: [simulate(ENGINE=engine, SHARDS="2", SIM_YEARS="3", SEED=str(seed)) for seed in range(8)]
+            for engine in ("array", "sharded")}
+    (array, array_se), (sharded, sharded_se) = prevalence(runs["array"]), prevalence(runs["sharded"])
+    assert abs(sharded - array) < 4 * np.hypot(array_se, sharded_se)
+    incident = {engine: np.mean([data.incident_counts.sum() for data in datas]) for engine, datas in runs.items()}
+    assert incident["sharded"] == pytest.approx(incident["array"], rel=0.1)
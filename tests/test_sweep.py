@@ -0,0 +1,69 @@
+import csv
+import configparser
+import numpy as np
+import pytest
+import sweep
+from sweep import design, PrevalenceBand
+from main import make_jobs, run_job
+
+
+def test_grid_runs_every_combination():
+    points = design({"DUR_MARITAL": "10:30", "PROB_CASUAL": "0.2, 0.4"}, {"DESIGN": "grid", "GRID_STEPS": "3"})
+    assert points == [{"DUR_MARITAL": duration, "PROB_CASUAL": prob}
+                      for duration in ("10", "20", "30") for prob in ("0.2", "0.4")]
+
+
+def test_lhs_puts_one_point_in_each_stratum():
+    parameters = {"TRANSMISSION_PER_SEX_ACT": "0.1:0.9", "DUR_MARITAL": "10:50", "PROB_CASUAL": "0.2, 0.3, 0.4, 0.5"}
+    points = design(parameters, {"DESIGN": "lhs", "POINTS": "8", "SEED": "4"})
+    assert len(points) == 8
+    transmission = np.array([float(p["TRANSMISSION_PER_SEX_ACT"]) for p in points])
+    assert sorted(((transmission - 0.1) / 0.8 * 8).astype(int).tolist()) == list(range(8))
+    # ranges with whole-number ends give whole values
+    assert all(p["DUR_MARITAL"].isdigit() and 10 <= int(p["DUR_MARITAL"]) <= 50 for p in points)
+    # levels are spread evenly, twice each for 8 points
+    assert sorted(p["PROB_CASUAL"] for p in points) == sorted(["0.2", "0.3", "0.4", "0.5"] * 2)
+    assert design(parameters, {"DESIGN": "lhs", "POINTS": "8", "SEED": "4"}) == points
+
+
+def test_unknown_design_is_an_error():
+    with pytest.raises(ValueError, match="DESIGN"):
+        design({"DUR_MARITAL": "10:30"}, {"DESIGN": "sobol"})
+
+
+class Counts:
+    # the two Data tables PrevalenceBand reads, 3 ages by 2 years
+    totalalive = np.array([[10, 10], [10, 10], [0, 0]])
+    prevalentinfections = np.array([[1, 5], [3, 5], [0, 0]])
+
+
+def test_prevalence_band_checks_whole_years_after_burn_in():
+    band = PrevalenceBand(0.1, 0.3)
+    assert not band(Counts, {"month": 5, "year": 0})
+    assert not band(Counts, {"month": 11, "year": 0})
+    assert band(Counts, {"month": 23, "year": 1})
+    assert not PrevalenceBand(0.1, 0.3, ages=slice(0, 1))(Counts, {"month": 11, "year": 0})
+    assert PrevalenceBand(0.2, 0.3, ages=slice(0, 1))(Counts, {"month": 11, "year": 0})
+    assert not PrevalenceBand(0.1, 0.3, first_year=2)(Counts, {"month": 23, "year": 1})
+
+
+def test_run_stops_when_prevalence_leaves_the_band(params):
+    params.update(ENGINE="array", RESULT_CACHE="")
+    job, = make_jobs("band", params)
+    assert run_job(job, stop=PrevalenceBand(0.0, 1e-6))["stopped"] == 11
+    assert run_job(job, stop=PrevalenceBand(0.0, 1.0))["stopped"] is None
+
+
+def test_sweep_writes_one_row_per_point(params, tmp_path):
+    config = configparser.ConfigParser()
+    config.read_dict({"model": dict(params, ENGINE="array", SIM_YEARS="1", RESULT_CACHE=""),
+                      "sweep": {"DESIGN": "grid", "GRID_STEPS": "2", "PREVALENCE_MAX": "1e-6"},
+                      "parameters": {"TRANSMISSION_PER_SEX_ACT": "0.2:0.6"}})
+    with open(tmp_path / "calibration.ini", "w") as f:
+        config.write(f)
+    sweep.main([str(tmp_path / "calibration.ini")])
+    with open("sweep_calibration.csv") as f:
+        rows = list(csv.DictReader(f))
+    # configparser keeps option names in lowercase
+    assert [(row["run"], row["transmission_per_sex_act"], row["stopped"]) for row in rows] == [
+        ("calibration_000", "0.2", "11"), ("calibration_001", "0.6", "11")]